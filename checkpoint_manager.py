@@ -2,36 +2,188 @@
 # File-based checkpoint manager for deduplication and state tracking
 import os
 import json
+import mmap
 import logging
 import time
-import tempfile
-import shutil
 import threading
-from typing import Optional, Set, Dict
+from functools import partial
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+from typing import Optional, Set, Dict, List
+
+# Use orjson for checkpoint (de)serialization when available - it is several
+# times faster than stdlib json on large id_tracking dicts
+try:
+    import orjson
+
+    def _dumps(obj, pretty=False):
+        # OPT_NON_STR_KEYS: numeric IDs are tracked as int dict keys
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj, pretty=False):
+        if pretty:
+            return json.dumps(obj, indent=2).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def _loads(data):
+        # json cannot parse a memoryview (mmap'd snapshot) directly
+        return json.loads(bytes(data))
+
+
+# IDs below this fit orjson's 64-bit int keys with room to spare
+_MAX_INT_ID = 10 ** 18
+
+
+def _coerce_id(item_id):
+    # Track canonical numeric IDs as ints (cheaper to hash and store than
+    # strings); anything else is tracked as its string form
+    # Exact-type checks first - this runs for every lookup and add
+    cls = type(item_id)
+    if cls is str:
+        str_id = item_id  # Common case (UUIDs, composite keys) - no copy
+    elif cls is int:
+        if 0 <= item_id < _MAX_INT_ID:
+            return item_id
+        return str(item_id)
+    elif (isinstance(item_id, int) and not isinstance(item_id, bool) and
+            0 <= item_id < _MAX_INT_ID):
+        return int(item_id)
+    else:
+        str_id = str(item_id)
+    # Length test first rejects UUIDs/composite keys without scanning them
+    if (len(str_id) <= 18 and str_id.isdigit() and str_id.isascii() and
+            (str_id[0] != '0' or len(str_id) == 1)):
+        return int(str_id)
+    return str_id
+
+
+def _track_ids(id_tracking, id_keys, timestamp):
+    # Record id_keys at timestamp, with the loops running in C
+    # Re-added IDs are removed first so they move to the end and
+    # id_tracking stays in timestamp order
+    for id_key in id_tracking.keys() & set(id_keys):
+        del id_tracking[id_key]
+    id_tracking.update(zip(id_keys, repeat(timestamp)))
+
+
+def _temp_path(filepath):
+    # Per-process temp file next to filepath, renamed over it once written
+    return '{}.{}.tmp'.format(filepath, os.getpid())
+
+
+# Optional zstd compression for snapshots (the append log stays plain so it
+# can be appended to)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Frame magic used to detect compressed snapshots on load
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+# Open/rename relative to a held directory fd where the platform allows it
+_DIR_FD_SUPPORTED = (
+    hasattr(os, 'O_DIRECTORY') and os.open in os.supports_dir_fd and
+    os.rename in os.supports_dir_fd)
+
+# Max buffers per writev() call
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 0
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
 
 
 class FileCheckpoint:
     # Manages checkpoints with in-memory caching and periodic disk writes
     # Thread-safe for concurrent feed processing
+    #
+    # id_tracking is kept in insertion order == timestamp order (stamps are
+    # monotonic and re-added IDs move to the end), so the oldest IDs are
+    # always at the head - retention and trimming only touch the head
+    #
+    # On-disk layout per key:
+    #   {prefix}_{key}.json - compact snapshot of the full checkpoint state
+    #   {prefix}_{key}.log  - append-only NDJSON log of IDs added since the
+    #                         last snapshot ({"i": id, "t": timestamp}, or
+    #                         {"ids": [...], "t": timestamp} per batch)
+    # plus one {prefix}.timestamps file mapping every key to its
+    # last_timestamp, which overrides the snapshot value
+    # The log is replayed on load and folded into the snapshot (compaction)
+    # once it grows past COMPACT_RATIO x the snapshot size
+
+    # Compact when log exceeds this multiple of the snapshot size
+    COMPACT_RATIO = 2
+    # Never compact logs smaller than this (avoids churn on tiny snapshots)
+    COMPACT_MIN_BYTES = 1048576
+    # Worker threads used by flush_all to write keys in parallel
+    FLUSH_WORKERS = 4
 
     def __init__(self, checkpoint_dir="checkpoints", key_prefix="tenable",
-                 max_ids=100000, retention_days=30, flush_interval=100):
+                 max_ids=100000, retention_days=30, flush_interval=100,
+                 pretty=False, compress=False, max_cached_keys=32):
         # Initialize checkpoint manager with configuration
         self.checkpoint_dir = checkpoint_dir
         self.key_prefix = key_prefix
         self.max_ids = max_ids  # Max IDs to track per feed
         self.retention_seconds = retention_days * 86400  # Convert days to seconds
         self.flush_interval = flush_interval  # Auto-flush after N IDs
+        self.pretty = pretty  # Indent snapshots (debugging only)
+        self.max_cached_keys = max_cached_keys  # LRU bound on cached keys
+
+        # zstd-compress snapshots (requires the zstandard package)
+        self.compress = compress
+        if compress and not ZSTD_AVAILABLE:
+            logging.warning(
+                "CHECKPOINT_COMPRESS requested but zstandard is not "
+                "installed - writing uncompressed snapshots")
+            self.compress = False
+        # ZstdCompressor is not thread-safe and snapshots are written from
+        # the flush pool and compaction threads - one per thread
+        self._zstd_local = threading.local()
 
         # Thread lock for safe concurrent access
         self._lock = threading.Lock()
+        # Per-key locks held while a key's files are written (see flush)
+        self._key_locks: Dict[str, threading.Lock] = defaultdict(
+            threading.Lock)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        # Keys with a background compaction queued or running
+        self._compacting: Set[str] = set()
 
         # In-memory cache for performance (reduces disk I/O)
-        self._cache: Dict[str, Dict] = {}  # Cached checkpoint data
-        # Keys that need to be written to disk
+        # LRU ordered - least recently loaded/used key first
+        self._cache: Dict[str, Dict] = OrderedDict()  # Cached checkpoint data
+        # Keys whose snapshot needs a full rewrite (non-ID state changed)
         self._dirty_keys: Set[str] = set()
         # Count of pending writes per key
         self._pending_count: Dict[str, int] = {}
+        # Serialized log records not yet appended to disk
+        self._pending_log: Dict[str, List[bytes]] = {}
+        # Current on-disk sizes used to decide when to compact
+        self._log_sizes: Dict[str, int] = {}
+        self._snapshot_sizes: Dict[str, int] = {}
+        # Append-log fds kept open across flushes (opened on first append)
+        self._log_fds: Dict[str, int] = {}
+        # Memoized per-key file paths
+        self._snapshot_paths: Dict[str, str] = {}
+        self._log_paths: Dict[str, str] = {}
+        # last_timestamp per key, shared across keys in one small file
+        self._timestamps: Optional[Dict[str, int]] = None
+        # The timestamps file is written outside self._lock, under its own
+        # lock; versions keep an older payload from landing after a newer
+        self._ts_lock = threading.Lock()
+        self._ts_version = 0
+        self._ts_written = 0
 
         # Global timestamp counter to ensure monotonic timestamps across
         # batches
@@ -44,14 +196,117 @@ class FileCheckpoint:
                 "Created checkpoint directory: {}".format(
                     self.checkpoint_dir))
 
+        # Hold the directory open so file opens/renames skip re-resolving
+        # the checkpoint_dir path on every flush
+        self._dir_fd: Optional[int] = None
+        if _DIR_FD_SUPPORTED:
+            try:
+                self._dir_fd = os.open(
+                    self.checkpoint_dir, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError:
+                pass
+
+    def _open(self, path, flags, mode=0o644):
+        # os.open of a checkpoint file, relative to the directory fd
+        if self._dir_fd is not None:
+            return os.open(os.path.basename(path), flags, mode,
+                           dir_fd=self._dir_fd)
+        return os.open(path, flags, mode)
+
+    def _replace(self, src, dst):
+        # Atomic rename within the checkpoint directory
+        if self._dir_fd is not None:
+            os.replace(os.path.basename(src), os.path.basename(dst),
+                       src_dir_fd=self._dir_fd, dst_dir_fd=self._dir_fd)
+        else:
+            os.replace(src, dst)
+
     def _get_checkpoint_file(self, key):
-        filename = "{}_{}.json".format(self.key_prefix, key)
+        # Paths are memoized - they are needed on every load and flush
+        filepath = self._snapshot_paths.get(key)
+        if filepath is None:
+            filename = "{}_{}.json".format(self.key_prefix, key)
+            filepath = os.path.join(self.checkpoint_dir, filename)
+            self._snapshot_paths[key] = filepath
+        return filepath
+
+    def _get_log_file(self, key):
+        filepath = self._log_paths.get(key)
+        if filepath is None:
+            filename = "{}_{}.log".format(self.key_prefix, key)
+            filepath = os.path.join(self.checkpoint_dir, filename)
+            self._log_paths[key] = filepath
+        return filepath
+
+    def _get_ts_file(self):
+        filename = "{}.timestamps".format(self.key_prefix)
         return os.path.join(self.checkpoint_dir, filename)
 
+    def _get_scan_file(self, key):
+        filename = "{}_{}.last_scan".format(self.key_prefix, key)
+        return os.path.join(self.checkpoint_dir, filename)
+
+    def _load_timestamps(self):
+        # Read the shared timestamps file once per process
+        # Note: caller must hold self._lock
+        if self._timestamps is None:
+            self._timestamps = {}
+            try:
+                with open(self._get_ts_file(), 'rb') as f:
+                    self._timestamps = _loads(f.read())
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                # Interrupted write - fall back to the snapshot values
+                logging.error(
+                    "Error loading checkpoint timestamps: {}".format(e))
+        return self._timestamps
+
+    def _stage_timestamps(self):
+        # Serialize the timestamps for _write_timestamps, numbered in the
+        # order they were taken
+        # Note: caller must hold self._lock
+        self._ts_version += 1
+        return self._ts_version, _dumps(self._timestamps)
+
+    def _write_timestamps(self, staged):
+        # Rewrite the shared timestamps file (temp + rename) - it holds one
+        # small int per key, so this stays tiny regardless of ID counts
+        # Note: call without self._lock, so per-key work is not held up
+        # behind the disk write. A payload older than the last one written
+        # is dropped
+        version, payload = staged
+        with self._ts_lock:
+            if version <= self._ts_written:
+                return
+            ts_path = self._get_ts_file()
+            temp_path = _temp_path(ts_path)
+            fd = self._open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            try:
+                os.write(fd, payload)
+            finally:
+                os.close(fd)
+            self._replace(temp_path, ts_path)
+            self._ts_written = version
+
+    def _set_ts(self, key, timestamp):
+        # Record last_timestamp on its own so advancing it does not
+        # rewrite the whole id_tracking snapshot. Returns the payload to
+        # pass to _write_timestamps once self._lock is released
+        # Note: caller must hold self._lock
+        self._load_timestamps()[key] = timestamp
+        return self._stage_timestamps()
+
+    def _read_ts(self, key):
+        # Returns the stored timestamp for key, or None if there is none
+        # Note: caller must hold self._lock
+        return self._load_timestamps().get(key)
+
     def _load_checkpoint(self, key):
         # Load checkpoint from disk into memory cache (lazy loading)
         # Note: caller must hold self._lock
         if key in self._cache:
+            self._cache.move_to_end(key)
             return  # Already loaded
 
         filepath = self._get_checkpoint_file(key)
@@ -63,99 +318,449 @@ class FileCheckpoint:
             'total_tracked': 0  # Total IDs tracked
         }
 
+        self._snapshot_sizes[key] = 0
         try:
-            if os.path.exists(filepath):
-                with open(filepath, 'r') as f:
-                    loaded_data = json.load(f)
-                    data.update(loaded_data)
-
-                    # Migrate old format if needed (backward compatibility)
-                    if 'processed_ids' in loaded_data and 'id_tracking' not in loaded_data:
-                        current_time = int(time.time())
-                        data['id_tracking'] = {
-                            str(pid): current_time
-                            for pid in loaded_data.get('processed_ids', [])
-                        }
+            # Parse straight from the page cache via mmap rather than
+            # copying the whole file into a bytes object first
+            fd = self._open(filepath, os.O_RDONLY)
+            try:
+                size = os.fstat(fd).st_size
+                mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ) if size else None
+            finally:
+                os.close(fd)
+            self._snapshot_sizes[key] = size
+
+            raw = memoryview(mm) if mm is not None else b''
+            try:
+                if raw[:4] == _ZSTD_MAGIC:
+                    if not ZSTD_AVAILABLE:
+                        raise RuntimeError(
+                            "snapshot is zstd-compressed but zstandard is "
+                            "not installed")
+                    plain = zstandard.ZstdDecompressor().decompress(raw)
+                    # Compaction compares the log against the uncompressed
+                    # snapshot size (both are plain NDJSON/JSON bytes)
+                    self._snapshot_sizes[key] = len(plain)
+                    loaded_data = _loads(plain)
+                    del plain
+                else:
+                    if self.compress and size:
+                        # Plaintext snapshot - rewrite it compressed on
+                        # next flush
+                        self._dirty_keys.add(key)
+                    loaded_data = _loads(raw)
+            finally:
+                if mm is not None:
+                    raw.release()
+                    mm.close()
+            data.update(loaded_data)
+
+            # Migrate old format if needed (backward compatibility)
+            if 'processed_ids' in loaded_data and 'id_tracking' not in loaded_data:
+                current_time = int(time.time())
+                data['id_tracking'] = {
+                    str(pid): current_time
+                    for pid in loaded_data.get('processed_ids', [])
+                }
+            # Legacy duplicate of the id_tracking keys - no longer written
+            data.pop('processed_ids', None)
+
+            # JSON object keys are always strings - restore numeric IDs
+            # Whole batches share one timestamp, but the parser creates a
+            # separate float per entry - intern them so each distinct stamp
+            # is stored once (saves a float object per tracked ID)
+            stamps = {}
+            intern_ts = stamps.setdefault
+            data['id_tracking'] = {
+                _coerce_id(id_key): intern_ts(ts, ts)
+                for id_key, ts in data['id_tracking'].items()
+            }
+        except FileNotFoundError:
+            pass  # New key - start from the empty checkpoint
         except Exception as e:
             logging.error(
                 "Error loading checkpoint {}: {}".format(
                     filepath, e))
 
+        # Replay IDs appended since the last snapshot
+        self._replay_log(key, data['id_tracking'])
+
+        # Sidecar is written on every set_last_timestamp and may be newer
+        sidecar_ts = self._read_ts(key)
+        if sidecar_ts is not None:
+            data['last_timestamp'] = sidecar_ts
+
+        # Snapshots written before ordered tracking may be out of order -
+        # sort once here so every later pass can work from the head
+        id_tracking = data['id_tracking']
+        prev_ts = None
+        for ts in id_tracking.values():
+            if prev_ts is not None and ts < prev_ts:
+                data['id_tracking'] = id_tracking = dict(
+                    sorted(id_tracking.items(), key=lambda x: x[1]))
+                break
+            prev_ts = ts
+        if id_tracking:
+            # Keep new stamps after everything already tracked
+            newest = id_tracking[next(reversed(id_tracking))]
+            self._last_timestamp = max(self._last_timestamp, newest)
+
         # Store in cache
         self._cache[key] = data
         self._pending_count[key] = 0
+        self._evict_cached_keys(keep=key)
 
-    def _atomic_write(self, filepath, data):
-        # Write to temp file first
-        dir_name = os.path.dirname(filepath)
-        fd, temp_path = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+    def _evict_cached_keys(self, keep=None):
+        # Drop least recently used keys beyond max_cached_keys
+        # Only clean keys are evicted (nothing pending, no flush running),
+        # so dropping them loses nothing - they reload from disk on demand
+        # Note: caller must hold self._lock
+        excess = len(self._cache) - self.max_cached_keys
+        if excess <= 0:
+            return
+
+        for k in list(self._cache):
+            if excess <= 0:
+                break
+            if (k == keep or k in self._dirty_keys or
+                    self._pending_log.get(k)):
+                continue
+            # Never block on a key lock while holding self._lock
+            key_lock = self._key_locks[k]
+            if not key_lock.acquire(blocking=False):
+                continue
+            try:
+                self._close_log_fd(k)
+            except OSError:
+                pass
+            finally:
+                del self._cache[k]
+                self._pending_count.pop(k, None)
+                self._log_sizes.pop(k, None)
+                self._snapshot_sizes.pop(k, None)
+                key_lock.release()
+            excess -= 1
+            logging.debug("Evicted checkpoint {} from cache".format(k))
+
+    def _replay_log(self, key, id_tracking):
+        # Apply append-log records on top of the loaded snapshot
+        # Note: caller must hold self._lock
+        logpath = self._get_log_file(key)
+        self._log_sizes[key] = 0
 
         try:
-            with os.fdopen(fd, 'w') as f:
-                json.dump(data, f, indent=2)
+            with open(logpath, 'rb') as f:
+                size = 0
+                for line in f:
+                    size += len(line)
+                    try:
+                        record = _loads(line)
+                        ids = record.get('ids')
+                        if ids is None:
+                            ids = (record['i'],)
+                        _track_ids(id_tracking, ids, record['t'])
+                    except (ValueError, KeyError, TypeError):
+                        # Partial trailing line from an interrupted write
+                        continue
+            self._log_sizes[key] = size
+        except FileNotFoundError:
+            pass  # Nothing appended since the last snapshot
+        except Exception as e:
+            logging.error(
+                "Error replaying checkpoint log {}: {}".format(
+                    logpath, e))
+
+    def _get_log_fd(self, key):
+        # Open the key's append log once and reuse the fd for every flush
+        # Note: caller must hold the key lock
+        fd = self._log_fds.get(key)
+        if fd is None:
+            fd = self._open(self._get_log_file(key),
+                            os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            self._log_fds[key] = fd
+        return fd
+
+    def _close_log_fd(self, key):
+        # Note: caller must hold the key lock
+        fd = self._log_fds.pop(key, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _close_log_fds(self):
+        for key in list(self._log_fds):
+            with self._get_key_lock(key):
+                try:
+                    self._close_log_fd(key)
+                except OSError:
+                    pass
+
+    def _sync_log(self, key):
+        # Durability barrier for the key's append log - fdatasync skips the
+        # metadata flush fsync would do (falls back where unavailable)
+        # Note: caller must hold the key lock
+        fd = self._log_fds.get(key)
+        if fd is None:
+            return
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+
+    def _append_log(self, key, records):
+        # Append serialized ID records to the key's log with gather writes
+        # (one writev per IOV_MAX records instead of joining into one buffer)
+        # Note: caller must hold the key lock
+        fd = self._get_log_fd(key)
+
+        written = 0
+        for start in range(0, len(records), _IOV_MAX):
+            chunk = records[start:start + _IOV_MAX]
+            expected = sum(map(len, chunk))
+            n = os.writev(fd, chunk)
+            if n < expected:
+                # Short write - finish the remainder with plain writes
+                os.write(fd, b''.join(chunk)[n:])
+            written += expected
+        self._log_sizes[key] = self._log_sizes.get(key, 0) + written
+
+    def _needs_compaction(self, key):
+        snapshot_size = self._snapshot_sizes.get(key, 0)
+        if not snapshot_size:
+            return True  # Write the initial snapshot so the key is listed
+        log_size = self._log_sizes.get(key, 0)
+        if log_size < self.COMPACT_MIN_BYTES:
+            return False
+        return log_size > snapshot_size * self.COMPACT_RATIO
+
+    def _zstd_compressor(self):
+        # This thread's compressor, created on first use
+        enc = getattr(self._zstd_local, 'enc', None)
+        if enc is None:
+            enc = self._zstd_local.enc = zstandard.ZstdCompressor(level=3)
+        return enc
+
+    def _atomic_write(self, filepath, payload):
+        # Write serialized snapshot bytes to a temp file first
+        # The temp name carries the pid - within this process writes for a
+        # key are serialized by its key lock, and a second collector sharing
+        # the checkpoint dir (e.g. overlapping cron runs) gets its own file
+        # rather than truncating ours before the rename
+        temp_path = _temp_path(filepath)
 
-            # Atomic rename (on POSIX systems)
-            shutil.move(temp_path, filepath)
+        try:
+            if self.compress:
+                payload = self._zstd_compressor().compress(payload)
+            fd = self._open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            try:
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+
+            # Atomic rename - temp file is in the same directory, so this
+            # is a single rename(2)
+            self._replace(temp_path, filepath)
         except Exception as e:
             # Clean up temp file on error
             if os.path.exists(temp_path):
                 os.remove(temp_path)
             raise e
 
+    def _get_key_lock(self, key):
+        # Per-key lock serializing disk I/O for one checkpoint key
+        # Lock order is always key lock -> self._lock, never the reverse
+        with self._lock:
+            return self._key_locks[key]
+
     def flush(self, key=None):
         # Write cached checkpoint data to disk
+        # New IDs are appended to the log; the snapshot is only rewritten
+        # when non-ID state changed or the log outgrew the snapshot
+        # Returns False if any key failed to write (its records are
+        # requeued for the next flush)
+        if key:
+            return self._flush_key(key)
+
+        ok = True
+        for k in self._keys_to_flush():
+            ok = self._flush_key(k) and ok
+        return ok
+
+    def _keys_to_flush(self):
         with self._lock:
-            keys_to_flush = [key] if key else list(self._dirty_keys)
+            return list(self._dirty_keys | set(self._pending_log))
 
-            for k in keys_to_flush:
+    def _keys_to_compact(self):
+        # Keys with anything beyond their snapshot (pending or logged IDs)
+        with self._lock:
+            return [
+                k for k in self._cache
+                if (k in self._dirty_keys or self._pending_log.get(k) or
+                    self._log_sizes.get(k))
+            ]
+
+    def _flush_key(self, k, compact=False):
+        # Snapshot/log state is captured under self._lock, then written out
+        # holding only the key lock so other keys (and readers) can proceed
+        # compact=True forces a snapshot rewrite regardless of log size
+        # Returns False if the write failed
+        with self._get_key_lock(k):
+            with self._lock:
                 if k not in self._cache:
-                    continue
+                    return True
+                records = self._pending_log.pop(k, None)
+                self._pending_count[k] = 0
+                compact = compact or k in self._dirty_keys
+                background = False
+                if not compact and self._needs_compaction(k):
+                    if self._snapshot_sizes.get(k):
+                        # Log outgrew the snapshot - append now and let a
+                        # pool thread fold it in, off the caller's path
+                        background = True
+                    else:
+                        compact = True  # First snapshot - small, write now
+                if compact:
+                    # Snapshot covers the pending records as well
+                    payload = self._prepare_snapshot(k)
+                    self._dirty_keys.discard(k)
 
-                filepath = self._get_checkpoint_file(k)
-                data = self._cache[k]
+            try:
+                if compact:
+                    self._write_snapshot(k, payload)
+                elif records:
+                    self._append_log(k, records)
+            except Exception as e:
+                # Requeue so the next flush retries instead of losing IDs
+                with self._lock:
+                    if records:
+                        self._pending_log[k] = (
+                            records + self._pending_log.get(k, []))
+                    if compact:
+                        self._dirty_keys.add(k)
+                logging.error(
+                    "Error flushing checkpoint {}: {}".format(
+                        k, e))
+                return False
 
-                try:
-                    # Apply retention and size limits before write
-                    current_time = int(time.time())
-                    cutoff_time = current_time - self.retention_seconds
-                    id_tracking = data.get('id_tracking', {})
-
-                    # Remove expired IDs (older than retention period)
-                    id_tracking = {
-                        id_key: ts for id_key, ts in id_tracking.items()
-                        if ts > cutoff_time
-                    }
-
-                    # Enforce max size limit (keep most recent IDs)
-                    if len(id_tracking) > self.max_ids:
-                        sorted_ids = sorted(
-                            id_tracking.items(), key=lambda x: x[1], reverse=True)
-                        id_tracking = dict(sorted_ids[:self.max_ids])
-                        logging.warning(
-                            "Checkpoint {} trimmed to {} IDs".format(
-                                k, self.max_ids))
-
-                    # Update cache and prepare for write
-                    data['id_tracking'] = id_tracking
-                    data['processed_ids'] = list(id_tracking.keys())
-                    data['last_cleanup'] = current_time
-                    data['total_tracked'] = len(id_tracking)
-
-                    # Write to disk atomically (prevents corruption)
-                    self._atomic_write(filepath, data)
-                    self._dirty_keys.discard(k)
-                    self._pending_count[k] = 0
+        if background:
+            self._schedule_compaction(k)
+        return True
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.FLUSH_WORKERS,
+                    thread_name_prefix='checkpoint-flush')
+            return self._pool
+
+    def _schedule_compaction(self, k):
+        # Queue a background snapshot rewrite for k; coalesced so repeated
+        # threshold hits while one is pending don't stack up
+        with self._lock:
+            if k in self._compacting:
+                return
+            self._compacting.add(k)
+        try:
+            self._get_pool().submit(self._background_compact, k)
+        except RuntimeError:
+            # Interpreter shutdown - compact inline instead
+            self._background_compact(k)
 
-                    logging.debug(
-                        "Flushed checkpoint {}: {} IDs".format(
-                            k, len(id_tracking)))
-                except Exception as e:
-                    logging.error(
-                        "Error flushing checkpoint {}: {}".format(
-                            k, e))
+    def _background_compact(self, k):
+        try:
+            self._flush_key(k, compact=True)
+        finally:
+            with self._lock:
+                self._compacting.discard(k)
+
+    def _prepare_snapshot(self, k):
+        # Apply retention and size limits and serialize the snapshot
+        # Note: caller must hold self._lock
+        data = self._cache[k]
+
+        # Apply retention and size limits before write
+        current_time = int(time.time())
+        cutoff_time = current_time - self.retention_seconds
+        id_tracking = data.get('id_tracking', {})
+
+        # Expired IDs (older than retention period) and the excess over
+        # max_ids (keep most recent IDs) are both at the head of the
+        # ordered dict, so one head slice covers both limits
+        expired = 0
+        for ts in id_tracking.values():
+            if ts > cutoff_time:
+                break
+            expired += 1
+        excess = len(id_tracking) - self.max_ids
+        drop = max(expired, excess)
+        if drop > 0:
+            for id_key in list(islice(id_tracking, drop)):
+                del id_tracking[id_key]
+        if excess > expired:
+            logging.warning(
+                "Checkpoint {} trimmed to {} IDs".format(
+                    k, self.max_ids))
+
+        # Update cache and prepare for write
+        data['id_tracking'] = id_tracking
+        data['last_cleanup'] = current_time
+        data['total_tracked'] = len(id_tracking)
+
+        logging.debug(
+            "Compacting checkpoint {}: {} IDs".format(
+                k, len(id_tracking)))
+        return _dumps(data, self.pretty)
+
+    def _write_snapshot(self, k, payload):
+        # Rewrite the snapshot and truncate the log
+        # Note: caller must hold the key lock
+        filepath = self._get_checkpoint_file(k)
+
+        # Write to disk atomically (prevents corruption), then drop the
+        # log - replaying it over the new snapshot would be a no-op anyway
+        self._atomic_write(filepath, payload)
+        # Uncompressed length, so COMPACT_RATIO means the same with
+        # CHECKPOINT_COMPRESS on (the log is never compressed)
+        self._snapshot_sizes[k] = len(payload)
+        fd = self._log_fds.get(k)
+        if fd is not None:
+            os.ftruncate(fd, 0)  # O_APPEND writes continue from offset 0
+        else:
+            os.close(self._open(self._get_log_file(k),
+                                os.O_WRONLY | os.O_CREAT | os.O_TRUNC))
+        self._log_sizes[k] = 0
 
     def flush_all(self):
-        self.flush()
+        # End of a run (or shutdown) - fold every key's log into a fresh
+        # snapshot so the next start replays nothing
+        # Keys write distinct files, so compact them in parallel and let
+        # the OS overlap the writes
+        keys = self._keys_to_compact()
+        compact_key = partial(self._flush_key, compact=True)
+        if len(keys) > 1:
+            try:
+                list(self._get_pool().map(compact_key, keys))
+            except RuntimeError:
+                # Interpreter shutdown (e.g. from __del__) - no new threads
+                for k in keys:
+                    compact_key(k)
+        else:
+            for k in keys:
+                compact_key(k)
+        # End of a run - release the cached log fds (reopened on demand)
+        self._close_log_fds()
+
+    def _next_timestamp(self):
+        # Monotonic tracking timestamp, unique to the microsecond across all
+        # keys and batches so insertion order always matches stamp order
+        # Note: caller must hold self._lock
+        timestamp = time.time()
+        if timestamp <= self._last_timestamp:
+            timestamp = self._last_timestamp + 0.000001
+        self._last_timestamp = timestamp
+        return timestamp
 
     def get_last_timestamp(self, key):
         with self._lock:
@@ -166,15 +771,55 @@ class FileCheckpoint:
             return int(val) if val else 0
 
     def set_last_timestamp(self, key, timestamp):
+        # Always store as int
+        timestamp = int(timestamp)
+        # Timestamps are important - persist immediately, after any pending
+        # IDs for this key so the two never go out of step on disk. If those
+        # IDs can't be written, the timestamp must not move past them
+        if not self.flush(key):
+            logging.error(
+                "Not advancing timestamp for checkpoint {}: pending IDs "
+                "could not be written".format(key))
+            return
+        try:
+            # Checkpoint boundary - make the appended IDs durable first
+            with self._get_key_lock(key):
+                self._sync_log(key)
+            with self._lock:
+                self._load_checkpoint(key)
+                self._cache[key]['last_timestamp'] = timestamp
+                staged = self._set_ts(key, timestamp)
+            self._write_timestamps(staged)
+        except Exception as e:
+            logging.error(
+                "Error writing timestamp for checkpoint {}: {}".format(
+                    key, e))
+
+    def get_last_scan_time(self, key):
+        # Last full-scan time is the mtime of a sentinel file, so checking
+        # it is one stat() rather than a load of the whole checkpoint
+        try:
+            return int(os.stat(self._get_scan_file(key)).st_mtime)
+        except FileNotFoundError:
+            pass
+        # Older checkpoints kept it in the snapshot
         with self._lock:
             self._load_checkpoint(key)
-            # Always store as int
-            self._cache[key]['last_timestamp'] = int(timestamp)
-            self._dirty_keys.add(key)
-        # Timestamps are important - flush immediately
-        self.flush(key)
+            return int(self._cache[key].get('last_full_scan') or 0)
+
+    def set_last_scan_time(self, key):
+        # Touch the sentinel - its mtime is the scan time
+        try:
+            os.close(self._open(self._get_scan_file(key),
+                                os.O_WRONLY | os.O_CREAT))
+            os.utime(self._get_scan_file(key))
+        except Exception as e:
+            logging.error(
+                "Error writing scan time for checkpoint {}: {}".format(
+                    key, e))
 
     def get_processed_ids(self, key):
+        # Returns a fresh set the caller may consume in place
         with self._lock:
             self._load_checkpoint(key)
 
@@ -182,21 +827,29 @@ class FileCheckpoint:
             cutoff_time = current_time - self.retention_seconds
             id_tracking = self._cache[key].get('id_tracking', {})
 
-            # Return only non-expired IDs
+            # Skip the expired head, return the rest (as strings, like
+            # callers passed them in)
+            expired = 0
+            for ts in id_tracking.values():
+                if ts > cutoff_time:
+                    break
+                expired += 1
             return {
-                id_key for id_key, ts in id_tracking.items()
-                if ts > cutoff_time
+                str(id_key) for id_key in islice(id_tracking, expired, None)
             }
 
     def add_processed_id(self, key, item_id):
         with self._lock:
             self._load_checkpoint(key)
 
-            # Add to in-memory cache
-            current_time = int(time.time())
-            self._cache[key].setdefault('id_tracking', {})[
-                str(item_id)] = current_time
-            self._dirty_keys.add(key)
+            # Add to in-memory cache and queue the log record
+            timestamp = self._next_timestamp()
+            id_key = _coerce_id(item_id)
+            id_tracking = self._cache[key].setdefault('id_tracking', {})
+            id_tracking.pop(id_key, None)
+            id_tracking[id_key] = timestamp
+            self._pending_log.setdefault(key, []).append(
+                _dumps({'i': id_key, 't': timestamp}) + b'\n')
             self._pending_count[key] = self._pending_count.get(key, 0) + 1
 
             # Check if auto-flush needed
@@ -213,24 +866,17 @@ class FileCheckpoint:
         with self._lock:
             self._load_checkpoint(key)
 
-            current_time = time.time()
             id_tracking = self._cache[key].setdefault('id_tracking', {})
 
-            # Ensure timestamps are monotonically increasing across all batches
-            # This prevents the same timestamp range from being reused in
-            # subsequent batches
-            if current_time <= self._last_timestamp:
-                current_time = self._last_timestamp + 0.000001
-
-            # Use incrementing microsecond timestamps to preserve order
-            # This ensures trimming keeps the most recently added IDs
-            for i, item_id in enumerate(item_ids):
-                # Add microseconds to ensure uniqueness and preserve order
-                timestamp = current_time + (i / 1000000.0)
-                id_tracking[str(item_id)] = timestamp
-                self._last_timestamp = timestamp  # Track globally across all batches
-
-            self._dirty_keys.add(key)
+            # One monotonic stamp for the whole batch - later batches still
+            # sort after it, so trimming keeps the most recently added IDs
+            timestamp = self._next_timestamp()
+            id_keys = list(map(_coerce_id, item_ids))
+            _track_ids(id_tracking, id_keys, timestamp)
+
+            # Whole batch goes to the log as a single record
+            self._pending_log.setdefault(key, []).append(
+                _dumps({'ids': id_keys, 't': timestamp}) + b'\n')
             self._pending_count[key] = self._pending_count.get(
                 key, 0) + len(item_ids)
 
@@ -238,27 +884,48 @@ class FileCheckpoint:
         self.flush(key)
 
     def is_processed(self, key, item_id):
+        # Hot path: most items streamed from an export are new, so keep the
+        # miss as cheap as possible - coerce outside the lock and skip the
+        # _load_checkpoint call once the key is cached (still touching its
+        # LRU position, so the busiest key is never the one evicted)
+        id_key = _coerce_id(item_id)
         with self._lock:
-            self._load_checkpoint(key)
-
-            id_tracking = self._cache[key].get('id_tracking', {})
-            str_id = str(item_id)
+            data = self._cache.get(key)
+            if data is None:
+                self._load_checkpoint(key)
+                data = self._cache[key]
+            else:
+                self._cache.move_to_end(key)
 
-            if str_id not in id_tracking:
+            # Single dict lookup; only consult the clock on a hit
+            ts = data['id_tracking'].get(id_key)
+            if ts is None:
                 return False
 
             # Check if expired
-            current_time = int(time.time())
-            cutoff_time = current_time - self.retention_seconds
-            return id_tracking[str_id] > cutoff_time
+            return ts > int(time.time()) - self.retention_seconds
 
     def clear_checkpoint(self, key):
         filepath = self._get_checkpoint_file(key)
 
         try:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                logging.info("Cleared checkpoint: {}".format(key))
+            with self._get_key_lock(key):
+                self._close_log_fd(key)
+            staged = None
+            with self._lock:
+                if self._load_timestamps().pop(key, None) is not None:
+                    staged = self._stage_timestamps()
+            if staged is not None:
+                self._write_timestamps(staged)
+            for path in (self._get_log_file(key), self._get_scan_file(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            os.remove(filepath)
+            logging.info("Cleared checkpoint: {}".format(key))
+        except FileNotFoundError:
+            pass
         except Exception as e:
             logging.error(
                 "Error clearing checkpoint {}: {}".format(
@@ -267,17 +934,19 @@ class FileCheckpoint:
     def get_all_checkpoints(self):
         checkpoints = []
 
+        prefix = self.key_prefix + '_'
+
         try:
-            for filename in os.listdir(self.checkpoint_dir):
-                if filename.startswith(
-                        self.key_prefix) and filename.endswith('.json'):
-                    # Extract key from filename
-                    key = filename.replace(
-                        self.key_prefix + '_',
-                        '').replace(
-                        '.json',
-                        '')
-                    checkpoints.append(key)
+            with os.scandir(self.checkpoint_dir) as entries:
+                for entry in entries:
+                    filename = entry.name
+                    # is_file() uses the dirent type - no extra stat()
+                    if (filename.startswith(prefix) and
+                            filename.endswith('.json') and entry.is_file()):
+                        # Extract key from filename
+                        checkpoints.append(
+                            filename.removeprefix(prefix).removesuffix(
+                                '.json'))
         except Exception as e:
             logging.error("Error listing checkpoints: {}".format(e))
 
@@ -290,6 +959,7 @@ class FileCheckpoint:
         stats = {
             'exists': False,
             'file_size_bytes': 0,
+            'log_size_bytes': 0,
             'total_ids': 0,
             'cached_ids': 0,
             'pending_writes': 0,
@@ -298,9 +968,12 @@ class FileCheckpoint:
         }
 
         try:
-            if os.path.exists(filepath):
+            try:
+                stats['file_size_bytes'] = os.stat(filepath).st_size
                 stats['exists'] = True
-                stats['file_size_bytes'] = os.path.getsize(filepath)
+            except FileNotFoundError:
+                pass
+            stats['log_size_bytes'] = self._log_sizes.get(key, 0)
 
             data = self._cache.get(key, {})
             stats['total_ids'] = len(data.get('id_tracking', {}))
@@ -318,8 +991,9 @@ class FileCheckpoint:
     def cleanup_all_checkpoints(self):
         for key in self.get_all_checkpoints():
             try:
-                self._load_checkpoint(key)
-                self._dirty_keys.add(key)
+                with self._lock:
+                    self._load_checkpoint(key)
+                    self._dirty_keys.add(key)
                 self.flush(key)
                 processed_ids = self.get_processed_ids(key)
                 logging.info(
@@ -335,3 +1009,9 @@ class FileCheckpoint:
             self.flush_all()
         except Exception:
             pass  # Ignore errors during cleanup
+        try:
+            if self._dir_fd is not None:
+                os.close(self._dir_fd)
+                self._dir_fd = None
+        except Exception:
+            pass
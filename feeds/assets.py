@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 # Asset feed processors with retry logic and unique export filters for
 # concurrent execution
+import re
 import time
 import logging
+import random
 from datetime import datetime
 from feeds.base import BaseFeedProcessor
 
@@ -34,6 +36,17 @@ def _parse_timestamp(ts_value):
     return 0
 
 
+# Error fragments meaning an export of this type is already running on
+# Tenable's side (retryable before any item was yielded)
+_EXPORT_RETRY_RE = re.compile(
+    r'429|duplicate export|export already running', re.IGNORECASE)
+
+
+def _is_retryable_export_error(error):
+    # Single case-insensitive scan - no lowercased copy of the message
+    return _EXPORT_RETRY_RE.search(str(error)) is not None
+
+
 def _safe_export_with_retry(
         export_func,
         feed_name,
@@ -45,27 +58,32 @@ def _safe_export_with_retry(
     # inter-feed delays
     logger = logging.getLogger(__name__)
     wait_time = initial_wait
+    export_started = False
 
     for attempt in range(max_retries + 1):
         try:
             logger.info("Starting {0} export (attempt {1}/{2})...".format(
                 feed_name, attempt + 1, max_retries + 1))
 
-            export_started = False
-            for item in export_func():
-                export_started = True  # Track if export started successfully
-                yield item
+            items = iter(export_func())
+            try:
+                first = next(items)
+            except StopIteration:
+                return  # Export completed with no items
+
+            # Track if export started successfully - set once, not per item
+            export_started = True
+            yield first
+            yield from items
 
             # Export completed successfully
             return
 
         except Exception as e:
-            error_msg = str(e).lower()
-
             # Only retry if export hasn't started (prevents duplicate items)
             if not export_started:
                 # Check for 429 rate limit or duplicate export error
-                if '429' in error_msg or 'duplicate export' in error_msg or 'export already running' in error_msg:
+                if _is_retryable_export_error(e):
                     if attempt < max_retries:
                         logger.warning(
                             "429 RATE LIMIT: Export already running on Tenable's side. "
@@ -75,7 +93,9 @@ def _safe_export_with_retry(
                             "NOTE: This is normal if a previous export is still processing. "
                             "Tenable exports can take 10-30 minutes to fully release.")
 
-                        time.sleep(wait_time)
+                        # Up to 10% jitter so feeds that hit the limit together
+                        # don't all retry in the same instant
+                        time.sleep(wait_time + random.uniform(0, wait_time * 0.1))
                         # Exponential backoff (max 10 min)
                         wait_time = min(wait_time * 1.5, 600)
                         continue
@@ -90,6 +110,18 @@ def _safe_export_with_retry(
             raise
 
 
+def _asset_id(asset):
+    return asset.get('id')
+
+
+def _has_agent(asset):
+    return asset.get('has_agent', False)
+
+
+def _is_terminated(asset):
+    return asset.get('terminated_at') is not None
+
+
 class AssetFeedProcessor(BaseFeedProcessor):
 
     def __init__(self, tenable_client, checkpoint_mgr,
@@ -138,32 +170,35 @@ class AssetFeedProcessor(BaseFeedProcessor):
                 self.logger.info("Full export (no previous checkpoint)")
 
             latest_timestamp = int(last_timestamp or 0)
+            # ISO-8601 UTC strings sort chronologically, so keep the raw
+            # maximum and parse it once after the export
+            latest_updated = ''
 
-            for asset in _safe_export_with_retry(
-                lambda: self.tenable.exports.assets(**export_kwargs),
-                "Asset Inventory"
-            ):
-                asset_id = asset.get('id')
-                if self.is_processed(asset_id):
-                    continue
-
+            def track_updated(asset):
                 # Track latest update timestamp for next incremental run
-                # Parse ISO timestamp string to unix epoch
-                asset_updated = _parse_timestamp(asset.get('updated_at'))
-                if asset_updated and asset_updated > latest_timestamp:
-                    latest_timestamp = asset_updated
-
-                if self.send_event(asset, item_id=asset_id):
-                    event_count += 1
-                    self.log_progress(event_count)
-
-                # Check if we've hit the limit
-                if self.should_stop(event_count):
-                    break
+                nonlocal latest_timestamp, latest_updated
+                asset_updated = asset.get('updated_at')
+                if isinstance(asset_updated, str):
+                    if asset_updated > latest_updated:
+                        latest_updated = asset_updated
+                elif asset_updated:
+                    asset_updated = _parse_timestamp(asset_updated)
+                    if asset_updated > latest_timestamp:
+                        latest_timestamp = asset_updated
+
+            event_count = self._run_export_loop(
+                _safe_export_with_retry(
+                    lambda: self.tenable.exports.assets(**export_kwargs),
+                    "Asset Inventory"),
+                _asset_id,
+                on_item=track_updated)
 
             # Flush any remaining events
             self.flush_events()
 
+            latest_timestamp = max(
+                latest_timestamp, _parse_timestamp(latest_updated))
+
             # Save latest timestamp for next incremental run
             if latest_timestamp > (last_timestamp or 0):
                 self.set_last_timestamp(latest_timestamp)
@@ -220,25 +255,14 @@ class AssetSelfScanProcessor(BaseFeedProcessor):
 
             current_time = int(time.time())
 
-            for asset in _safe_export_with_retry(
-                lambda: self.tenable.exports.assets(**export_kwargs),
-                "Agent-Based Assets"
-            ):
-                # Double-check has_agent flag (some agents may have different
-                # sources)
-                if not asset.get('has_agent', False):
-                    continue
-
-                asset_id = asset.get('id')
-                if self.is_processed(asset_id):
-                    continue
-
-                if self.send_event(asset, item_id=asset_id):
-                    event_count += 1
-                    self.log_progress(event_count)
-
-                if self.should_stop(event_count):
-                    break
+            # Double-check has_agent flag (some agents may have different
+            # sources)
+            event_count = self._run_export_loop(
+                _safe_export_with_retry(
+                    lambda: self.tenable.exports.assets(**export_kwargs),
+                    "Agent-Based Assets"),
+                _asset_id,
+                item_filter=_has_agent)
 
             self.flush_events()
 
@@ -278,10 +302,7 @@ class DeletedAssetProcessor(BaseFeedProcessor):
 
     def _should_run_full_scan(self):
         # Check if enough time has passed since last full scan
-        # Load checkpoint first to ensure cache is populated
-        self.checkpoint._load_checkpoint('deleted_asset')
-        checkpoint_data = self.checkpoint._cache.get('deleted_asset', {})
-        last_scan = checkpoint_data.get('last_full_scan', 0)
+        last_scan = self.checkpoint.get_last_scan_time('deleted_asset')
         current_time = int(time.time())
         time_since_scan = current_time - last_scan
         hours_since_scan = time_since_scan / 3600
@@ -314,14 +335,21 @@ class DeletedAssetProcessor(BaseFeedProcessor):
                 self.logger.info(
                     "No previous assets to compare - building baseline only")
 
-            current_assets = set()
+            # Diff while streaming: no copy is made - the previous-ID set
+            # (built fresh by get_processed_ids, nothing else holds it) has
+            # each exported ID discarded from it in place, so afterwards it
+            # holds only the deleted IDs. Current IDs go to the checkpoint
+            # in batch_size chunks as they arrive rather than being held
+            # until the export finishes
+            deleted_assets = previous_assets
+            current_assets = []
             self.logger.info("Fetching current assets from Tenable...")
             self.logger.info(
                 "(This may take 1-2 hours for large environments - runs max once per {0} hours)".format(
                     self.scan_interval_hours))
 
             asset_count = 0
-            start_time = time.time()
+            start_time = time.monotonic()
 
             # Optimized export parameters for full scan
             export_kwargs = {
@@ -334,22 +362,28 @@ class DeletedAssetProcessor(BaseFeedProcessor):
                 lambda: self.tenable.exports.assets(**export_kwargs),
                 "Deleted Assets"
             ):
-                current_assets.add(asset.get('id'))
+                asset_id = asset.get('id')
+                current_assets.append(asset_id)
+                deleted_assets.discard(asset_id)
                 asset_count += 1
 
+                if len(current_assets) >= self.batch_size:
+                    self.mark_processed_batch(current_assets)
+                    current_assets = []
+
                 # Log progress every 1000 assets with time estimate
-                if asset_count % 1000 == 0:
-                    elapsed = time.time() - start_time
+                if (asset_count % 1000 == 0 and
+                        self.logger.isEnabledFor(logging.INFO)):
+                    elapsed = time.monotonic() - start_time
                     rate = asset_count / elapsed if elapsed > 0 else 0
-                    self.logger.info("Fetched {0} assets... ({1:.0f} assets/sec)".format(
-                        asset_count, rate))
+                    self.logger.info(
+                        "Fetched %d assets... (%.0f assets/sec)",
+                        asset_count, rate)
 
-            elapsed_total = time.time() - start_time
+            elapsed_total = time.monotonic() - start_time
             self.logger.info(
                 "Found {0} current assets in {1:.1f} minutes".format(
-                    len(current_assets), elapsed_total / 60))
-
-            deleted_assets = previous_assets - current_assets
+                    asset_count, elapsed_total / 60))
 
             if deleted_assets:
                 self.logger.info(
@@ -367,22 +401,12 @@ class DeletedAssetProcessor(BaseFeedProcessor):
             else:
                 self.logger.info("No deleted assets detected")
 
-            # Update checkpoint with current assets
-            for asset_id in current_assets:
-                self.mark_processed(asset_id)
+            # Record the tail of current assets not yet checkpointed
+            if current_assets:
+                self.mark_processed_batch(current_assets)
 
             # Record the scan time in checkpoint
-            try:
-                self.checkpoint._load_checkpoint('deleted_asset')
-                checkpoint_data = self.checkpoint._cache.get(
-                    'deleted_asset', {})
-                checkpoint_data['last_full_scan'] = int(time.time())
-                self.checkpoint._cache['deleted_asset'] = checkpoint_data
-                self.checkpoint._dirty_keys.add('deleted_asset')
-            except Exception as checkpoint_err:
-                self.logger.warning(
-                    "Failed to update scan timestamp: {0}".format(
-                        str(checkpoint_err)))
+            self.checkpoint.set_last_scan_time('deleted_asset')
 
             self.flush_events()
 
@@ -436,24 +460,12 @@ class TerminatedAssetProcessor(BaseFeedProcessor):
 
             current_time = int(time.time())
 
-            for asset in _safe_export_with_retry(
-                lambda: self.tenable.exports.assets(**export_kwargs),
-                "Terminated Assets"
-            ):
-                if 'terminated_at' not in asset or asset.get(
-                        'terminated_at') is None:
-                    continue
-
-                asset_id = asset.get('id')
-                if self.is_processed(asset_id):
-                    continue
-
-                if self.send_event(asset, item_id=asset_id):
-                    event_count += 1
-                    self.log_progress(event_count)
-
-                if self.should_stop(event_count):
-                    break
+            event_count = self._run_export_loop(
+                _safe_export_with_retry(
+                    lambda: self.tenable.exports.assets(**export_kwargs),
+                    "Terminated Assets"),
+                _asset_id,
+                item_filter=_is_terminated)
 
             self.flush_events()
 
@@ -1,13 +1,52 @@
 #!/usr/bin/env python3
 # Base class for all Tenable feed processors
 import logging
+import logging.handlers
 import time
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _TimedMemoryHandler(logging.handlers.MemoryHandler):
+    # MemoryHandler that also flushes flush_interval seconds after the first
+    # record is buffered (on a timer thread), so a long export's feed log
+    # keeps moving and a feed that goes quiet doesn't hold records back
+
+    def __init__(self, capacity, flush_interval=5.0, **kwargs):
+        super(_TimedMemoryHandler, self).__init__(capacity, **kwargs)
+        self.flush_interval = flush_interval
+        self._timer = None  # Armed while records are buffered
+
+    def shouldFlush(self, record):
+        # Called under self.lock, with the record already buffered
+        if super(_TimedMemoryHandler, self).shouldFlush(record):
+            return True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return False
+
+    def flush(self):
+        with self.lock:  # RLock - MemoryHandler.flush takes it again
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            super(_TimedMemoryHandler, self).flush()
 
 
 class BaseFeedProcessor(object):
     # Base processor with checkpointing, batching, and deduplication
 
+    # Default byte budget per batch on top of batch_size (0 = count only),
+    # only on by default for feeds with large records. Events are not
+    # measured here - the budget becomes an event count from the bytes HEC
+    # serialized for the previous batch, so the first batch is a short probe
+    EARLY_FLUSH_BYTES = 0
+    BYTE_PROBE_EVENTS = 64
+
     def __init__(
             self,
             tenable_client,
@@ -32,9 +71,32 @@ class BaseFeedProcessor(object):
         self.max_events = max_events  # Max events to process (0 = unlimited)
         self.logger = logging.getLogger(__name__)
         self._event_buffer = []  # Buffer for batching events
-        self._buffer_ids = []  # IDs of buffered events for checkpointing
+        # IDs of buffered events for checkpointing (ID -> event position)
+        self._buffer_ids = {}
+        # Second buffer pair, filled while the first is sent to HEC
+        self._spare_buffers = ([], {})
+        self._sending_ids = ()  # IDs of the batch currently being sent
+        self._in_flight = None  # (future, events, ids) of that batch
+        self._hec_executor = None  # Single HEC worker, created on demand
+        # Undelivered parts of failed batches, sent once more at the end of
+        # the run. Bounded: when full, the oldest is dropped with a warning
+        # - for incremental feeds its events are not re-exported next run,
+        # as last_timestamp still advances
+        self._retry_batches = deque(maxlen=4)
         self._start_time = None  # Track processing time
         self._hec_sent_count = 0  # Track events successfully sent to HEC
+        # Events were lost since the last flush (dropped from the retry
+        # queue or not delivered by the end-of-run retry)
+        self._send_failed = False
+        # Event count of next progress line (None = first interval)
+        self._next_progress_log = None
+        # Flush early once buffered events reach about this many bytes
+        self.early_flush_bytes = int(
+            os.getenv('HEC_BATCH_MAX_BYTES', self.EARLY_FLUSH_BYTES))
+        # Events per batch: batch_size, or fewer to keep to the byte budget
+        self._flush_at = batch_size
+        if self.early_flush_bytes:
+            self._flush_at = min(batch_size, self.BYTE_PROBE_EVENTS)
 
         # Set up feed-specific log file
         self._setup_feed_logging(checkpoint_key)
@@ -52,17 +114,38 @@ class BaseFeedProcessor(object):
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         feed_handler.setFormatter(formatter)
-        self.logger.addHandler(feed_handler)
+
+        # Buffer records so progress lines don't each cost a write();
+        # warnings and errors flush straight away, the rest within 5s or at
+        # completion
+        self._feed_log_handler = _TimedMemoryHandler(
+            capacity=256,
+            flush_interval=5.0,
+            flushLevel=logging.WARNING,
+            target=feed_handler,
+            flushOnClose=True)
+        self._feed_log_handler.setLevel(logging.INFO)
+        self.logger.addHandler(self._feed_log_handler)
 
     def log_start(self):
-        self._start_time = time.time()
+        # Monotonic - elapsed/rate figures are immune to wall-clock steps
+        self._start_time = time.monotonic()
         self._hec_sent_count = 0
+        self._next_progress_log = None
         self.logger.info("Starting {0} feed...".format(self.feed_name))
 
     def log_progress(self, count, interval=10000):
-        # Log every 10000 events to reduce logging overhead in production
-        if count > 0 and count % interval == 0:
-            elapsed = time.time() - self._start_time
+        # Log every interval (default 10000) events to reduce logging
+        # overhead in production
+        # (a compare per event against the next threshold, no modulo)
+        threshold = self._next_progress_log
+        if threshold is None:
+            threshold = self._next_progress_log = interval
+        if count >= threshold:
+            self._next_progress_log = count + interval
+            if not self.logger.isEnabledFor(logging.INFO):
+                return
+            elapsed = time.monotonic() - self._start_time
             rate = count / elapsed if elapsed > 0 else 0
             self.logger.info(
                 "  [{0}] {1:,} events ({2:.0f}/sec)".format(
@@ -77,32 +160,41 @@ class BaseFeedProcessor(object):
         return False
 
     def log_completion(self, count):
-        elapsed = time.time() - self._start_time if self._start_time else 0
-        rate = count / elapsed if elapsed > 0 else 0
-        self.logger.info(
-            "  Completed {0}: {1:,} events processed, {2:,} sent to HEC in {3:.1f}min ({4:.0f}/sec)".format(
-                self.feed_name,
-                count,
-                self._hec_sent_count,
-                elapsed /
-                60,
-                rate))
+        if self.logger.isEnabledFor(logging.INFO):
+            elapsed = time.monotonic() - self._start_time if self._start_time else 0
+            rate = count / elapsed if elapsed > 0 else 0
+            self.logger.info(
+                "  Completed {0}: {1:,} events processed, {2:,} sent to HEC in {3:.1f}min ({4:.0f}/sec)".format(
+                    self.feed_name,
+                    count,
+                    self._hec_sent_count,
+                    elapsed /
+                    60,
+                    rate))
+        self._feed_log_handler.flush()
 
     def send_event(self, event_data, item_id=None):
         # Buffer event for batch sending (auto-flushes when batch size reached)
         try:
-            # Copy event data (feed_type/feed_name added as HEC fields during
-            # flush)
-            classified_event = dict(event_data)
-
-            # Add to buffer
-            self._event_buffer.append(classified_event)
             if item_id:
-                self._buffer_ids.append(item_id)  # Track ID for checkpointing
+                # Already waiting in this batch or the one being sent (not
+                # yet checkpointed, so is_processed can't see it) - don't
+                # send it twice
+                if item_id in self._buffer_ids or item_id in self._sending_ids:
+                    return False
+                # Track ID (and its event's position) for checkpointing
+                self._buffer_ids[item_id] = len(self._event_buffer)
+
+            # Buffered as-is: callers hand over single-use dicts and
+            # feed_type/feed_name are added as HEC fields during flush
+            self._event_buffer.append(event_data)
 
-            # Auto-flush when batch size reached
-            if len(self._event_buffer) >= self.batch_size:
-                return self.flush_events()
+            # Auto-flush when batch size (or the byte budget) is reached -
+            # the batch goes out in the background while the next one fills.
+            # The event is buffered either way; batch failures are reported
+            # by flush_events()
+            if len(self._event_buffer) >= self._flush_at:
+                self._submit_batch()
 
             return True
         except Exception as e:
@@ -111,37 +203,122 @@ class BaseFeedProcessor(object):
                     self.feed_name, str(e)))
             return False
 
+    def _get_hec_executor(self):
+        # Single worker: one batch in flight at a time, in order
+        if self._hec_executor is None:
+            self._hec_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='hec-send')
+        return self._hec_executor
+
+    def _submit_batch(self):
+        # Hand the filled buffers to the HEC worker and keep filling the
+        # spare pair meanwhile. Waiting for the previous batch first keeps
+        # memory bounded to two batches
+        self._wait_for_send()
+        events, ids = self._event_buffer, self._buffer_ids
+        self._event_buffer, self._buffer_ids = self._spare_buffers
+        self._sending_ids = ids
+        self._in_flight = (
+            self._get_hec_executor().submit(self._send_batch, events, ids),
+            events, ids)
+
+    def _wait_for_send(self):
+        # Collect the in-flight batch (if any) and recycle its buffers -
+        # emptied in place, they keep their capacity for a later batch
+        # A failed batch has already queued its undelivered events for the
+        # end-of-run retry (_send_batch handles its own errors)
+        if self._in_flight is None:
+            return
+
+        future, events, ids = self._in_flight
+        self._in_flight = None
+        try:
+            future.result()
+        except Exception as e:
+            self.logger.error(
+                "Failed to flush {0} events: {1}".format(
+                    self.feed_name, str(e)))
+            self._send_failed = True
+        events.clear()
+        ids.clear()
+        self._spare_buffers = (events, ids)
+        self._sending_ids = ()
+
     def flush_events(self):
-        # Send all buffered events to HEC and update checkpoints
-        if not self._event_buffer:
-            return True
+        # Send all buffered events to HEC, wait for every batch to land and
+        # update checkpoints. Returns False if any events since the last
+        # flush were not delivered, even after the end-of-run retry
+        if self._event_buffer:
+            self._submit_batch()
+        self._wait_for_send()
+
+        # One more go for what HEC rejected earlier in the run, so a
+        # transient outage doesn't mean re-exporting it from Tenable
+        while self._retry_batches:
+            events, ids = self._retry_batches.popleft()
+            self.logger.info(
+                "Retrying {0} undelivered {1} events...".format(
+                    len(events), self.feed_name))
+            if not self._send_batch(events, ids, requeue=False):
+                self._send_failed = True
+
+        if self._hec_executor is not None:
+            self._hec_executor.shutdown()
+            self._hec_executor = None
+        ok = not self._send_failed
+        self._send_failed = False
+        return ok
+
+    def _queue_retry(self, events, ids, delivered):
+        # Copy out the events HEC did not accept (with their IDs, positions
+        # renumbered) - the original buffers are recycled by the waiter
+        retry_events = []
+        retry_ids = {}
+        id_at = {position: item_id for item_id, position in ids.items()}
+        for position, event in enumerate(events):
+            if not delivered >> position & 1:
+                item_id = id_at.get(position)
+                if item_id is not None:
+                    retry_ids[item_id] = len(retry_events)
+                retry_events.append(event)
+        if len(self._retry_batches) == self._retry_batches.maxlen:
+            dropped_events, _ = self._retry_batches[0]
+            self.logger.warning(
+                "Retry queue full - dropping {0} undelivered {1} events".format(
+                    len(dropped_events), self.feed_name))
+            self._send_failed = True
+        self._retry_batches.append((retry_events, retry_ids))
 
+    def _send_batch(self, events, ids, requeue=True):
+        # Send one batch to HEC and checkpoint what was delivered (runs on
+        # the HEC worker thread; the buffers are cleared by the waiter)
+        delivered = 0
         try:
-            batch_size = len(self._event_buffer)
+            batch_size = len(events)
             self.logger.debug(
                 "Sending batch of {0} {1} events to HEC...".format(
                     batch_size, self.feed_name))
 
             # Send batch with feed classification
-            success_count = self.hec.send_batch(
-                self._event_buffer,
+            sizes = [] if self.early_flush_bytes else None
+            success_count, delivered = self.hec.send_batch(
+                events,
                 sourcetype=self.sourcetype,
                 feed_type=self.feed_type,
-                feed_name=self.feed_name
+                feed_name=self.feed_name,
+                sizes=sizes
             )
+            if sizes:
+                self._fit_batch_to_bytes(batch_size, sizes[0])
 
             if success_count == batch_size:
                 # Batch checkpoint write for better performance
-                if self._buffer_ids:
+                if ids:
                     self.checkpoint.add_processed_ids_batch(
-                        self.checkpoint_key, self._buffer_ids)
+                        self.checkpoint_key, ids)
 
                 # Track successful HEC sends
                 self._hec_sent_count += success_count
-
-                # Clear buffers
-                self._event_buffer = []
-                self._buffer_ids = []
                 return True
             elif success_count > 0:
                 # Partial success - mark successful items and log warning
@@ -149,36 +326,57 @@ class BaseFeedProcessor(object):
                     "Partial batch send: {0}/{1} events sent successfully".format(
                         success_count, batch_size))
 
-                # Batch checkpoint write for successful items
-                successful_ids = self._buffer_ids[:min(
-                    success_count, len(self._buffer_ids))]
+                # Batch checkpoint write for the events HEC accepted (the
+                # rest are retried once at the end of the run)
+                successful_ids = [item_id for item_id, position in ids.items()
+                                  if delivered >> position & 1]
                 if successful_ids:
                     self.checkpoint.add_processed_ids_batch(
                         self.checkpoint_key, successful_ids)
 
                 # Track partial HEC sends
                 self._hec_sent_count += success_count
-
-                # Clear buffers to prevent memory leak (items will be re-sent
-                # on next run via checkpoint)
-                self._event_buffer = []
-                self._buffer_ids = []
-                return False
             else:
-                # Complete failure - clear buffers to prevent memory leak
-                self.logger.error(
-                    "Batch send failed completely - clearing buffer to prevent memory leak")
-                self._event_buffer = []
-                self._buffer_ids = []
-                return False
+                self.logger.error("Batch send failed completely")
         except Exception as e:
             self.logger.error(
                 "Failed to flush {0} events: {1}".format(
                     self.feed_name, str(e)))
-            # Clear buffers even on exception to prevent memory leak
-            self._event_buffer = []
-            self._buffer_ids = []
-            return False
+
+        if requeue:
+            self._queue_retry(events, ids, delivered)
+        return False
+
+    def _fit_batch_to_bytes(self, event_count, byte_count):
+        # Size the next batches to the byte budget from what HEC serialized
+        # for this one (an estimate - events vary, HEC metadata included)
+        if event_count and byte_count:
+            per_event = byte_count / event_count
+            self._flush_at = max(1, min(
+                self.batch_size, int(self.early_flush_bytes / per_event)))
+
+    def _run_export_loop(self, items, item_key,
+                         item_filter=None, on_item=None):
+        # Shared export loop: skip filtered and already-processed items,
+        # send the rest and stop at max_events. Returns the events sent
+        event_count = 0
+        for item in items:
+            if item_filter is not None and not item_filter(item):
+                continue
+
+            item_id = item_key(item)
+            if self.is_processed(item_id):
+                continue
+
+            if on_item is not None:
+                on_item(item)
+
+            if self.send_event(item, item_id=item_id):
+                event_count += 1
+                self.log_progress(event_count)
+                if self.should_stop(event_count):
+                    break
+        return event_count
 
     def is_processed(self, item_id):
         # Check if item has already been processed (deduplication)
@@ -188,6 +386,10 @@ class BaseFeedProcessor(object):
         # Mark item as processed to prevent future duplicates
         self.checkpoint.add_processed_id(self.checkpoint_key, item_id)
 
+    def mark_processed_batch(self, item_ids):
+        # Mark many items as processed in one checkpoint update/flush
+        self.checkpoint.add_processed_ids_batch(self.checkpoint_key, item_ids)
+
     def get_last_timestamp(self):
         # Get last processed timestamp for incremental processing
         return self.checkpoint.get_last_timestamp(self.checkpoint_key)
@@ -1,8 +1,97 @@
 #!/usr/bin/env python3
 # Plugin and compliance feed processors using direct API calls (not exports)
 from feeds.base import BaseFeedProcessor
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict
+import os
+import re
 import time
+import random
 import logging
+import threading
+from functools import partial
+
+
+# Error fragments that mark a REST call as rate limited
+_RATE_LIMIT_RE = re.compile(r'429|rate limit', re.IGNORECASE)
+
+
+class TokenBucket(object):
+    # Paces REST calls shared by all feed/worker threads so the parallel
+    # fetches stay under the API ceiling instead of tripping 429s
+
+    # Longest pause taken from X-RateLimit-Reset (seconds)
+    MAX_RESET_PAUSE = 300
+
+    def __init__(self, refill_rate, capacity=None):
+        self.refill_rate = float(refill_rate)  # Tokens per second
+        self.capacity = float(capacity or max(1.0, self.refill_rate))
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0  # Set from X-RateLimit-Reset when drained
+        self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    def acquire(self):
+        # Block until a token is available
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self._cond.wait((1 - self.tokens) / self.refill_rate)
+
+    def update_from_headers(self, headers):
+        # Sync with the server's view of the window: X-RateLimit-Remaining
+        # caps the tokens left, X-RateLimit-Reset (seconds) pauses callers
+        # once the window is used up - clamped, so an epoch-style or bogus
+        # value can't stall every worker
+        if not headers:
+            return
+        try:
+            remaining = headers.get('X-RateLimit-Remaining')
+            reset = headers.get('X-RateLimit-Reset')
+            with self._cond:
+                if remaining is not None:
+                    self.tokens = min(self.tokens, float(remaining))
+                    if float(remaining) <= 0 and reset is not None:
+                        pause = min(float(reset), self.MAX_RESET_PAUSE)
+                        if pause > 0:
+                            self._paused_until = time.monotonic() + pause
+                self._cond.notify_all()
+        except (TypeError, ValueError):
+            pass
+
+
+_api_bucket = None
+_api_bucket_lock = threading.Lock()
+
+
+def _get_api_bucket():
+    # Created on first use so TENABLE_API_MAX_RPS from .env is seen;
+    # 0 disables pacing
+    global _api_bucket
+    with _api_bucket_lock:
+        if _api_bucket is None:
+            max_rps = float(os.getenv('TENABLE_API_MAX_RPS', 10))
+            _api_bucket = TokenBucket(max_rps) if max_rps > 0 else False
+        return _api_bucket
+
+
+def _response_headers(error):
+    # Headers of the response attached to an API error, if there is one
+    return getattr(getattr(error, 'response', None), 'headers', None)
 
 
 def _safe_api_call_with_retry(
@@ -13,17 +102,31 @@ def _safe_api_call_with_retry(
         **kwargs):
     # Retry wrapper for Tenable REST API calls (non-export endpoints)
     logger = logging.getLogger(__name__)
+    bucket = _get_api_bucket()
 
     for attempt in range(max_retries):
         try:
+            if bucket:
+                bucket.acquire()
             return api_func(*args, **kwargs)
         except Exception as e:
-            error_str = str(e)
-
-            # Check for 429 rate limit error
-            if '429' in error_str or 'rate limit' in error_str.lower():
+            # Check for 429 rate limit error (shouldn't happen with the
+            # bucket pacing calls, kept as a fallback). pyTenable returns
+            # parsed JSON, so rate-limit headers are only read from errors
+            if _RATE_LIMIT_RE.search(str(e)):
                 if attempt < max_retries - 1:
-                    wait_time = initial_wait * (1.5 ** attempt)
+                    headers = _response_headers(e)
+                    if bucket:
+                        bucket.update_from_headers(headers)
+                    try:
+                        wait_time = min(
+                            max(float(headers.get('Retry-After')), 0),
+                            TokenBucket.MAX_RESET_PAUSE)
+                    except (AttributeError, TypeError, ValueError):
+                        wait_time = initial_wait * (1.5 ** attempt)
+                        # Up to 10% jitter so plugin/compliance calls
+                        # throttled together don't all retry at once
+                        wait_time += random.uniform(0, wait_time * 0.1)
                     logger.warning(
                         f"Rate limit (429) on API call, waiting {wait_time:.0f}s before retry {attempt + 1}/{max_retries}")
                     time.sleep(wait_time)
@@ -40,8 +143,46 @@ def _safe_api_call_with_retry(
     raise Exception(f"API call failed after {max_retries} retries")
 
 
+_NO_ITEM = object()
+
+
+def _windowed_fetch(executor, fetch, items, window, ordered=False):
+    # Run fetch(item) for each item on executor, keeping at most `window`
+    # calls submitted but not yet consumed (counting the one handed to the
+    # caller), and yield (item, future) - in
+    # item order if ordered, else as they complete. Fetched results are
+    # only held until the caller has consumed them, so memory stays flat
+    # however many items there are
+    items = iter(items)
+    pending = OrderedDict()  # future -> item, in submission order
+
+    def fill(limit):
+        while len(pending) < limit:
+            item = next(items, _NO_ITEM)
+            if item is _NO_ITEM:
+                return
+            pending[executor.submit(fetch, item)] = item
+
+    fill(window)
+    while pending:
+        if ordered:
+            future, item = pending.popitem(last=False)
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = next(iter(done))
+            item = pending.pop(future)
+        # Top up before handing over, so fetching continues meanwhile
+        fill(window - 1)
+        yield item, future
+        del future, item
+
+
 class PluginFeedProcessor(BaseFeedProcessor):
 
+    # plugin_details records run to 50-200 KB each - bound batches by size
+    # as well as count
+    EARLY_FLUSH_BYTES = 16 * 1048576
+
     def __init__(self, tenable_client, checkpoint_mgr,
                  hec_handler, batch_size=5000, max_events=0):
         super(
@@ -57,6 +198,11 @@ class PluginFeedProcessor(BaseFeedProcessor):
             batch_size,
             max_events)
 
+        # Concurrent plugin_details calls per family (I/O bound - one
+        # REST round-trip per plugin)
+        self.detail_workers = max(
+            1, int(os.getenv('PLUGIN_DETAIL_WORKERS', 8)))
+
     def process(self):
         self.log_start()
         event_count = 0
@@ -77,30 +223,44 @@ class PluginFeedProcessor(BaseFeedProcessor):
                     family_details = _safe_api_call_with_retry(
                         self.tenable.plugins.family_details, family_id)
                     plugins = family_details.get('plugins', [])
+                    plugin_ids = [
+                        plugin_summary.get('id') for plugin_summary in plugins
+                        if not self.is_processed(str(plugin_summary.get('id')))]
+
+                    # Fetch details concurrently through a bounded window
+                    # (large families would otherwise hold every result);
+                    # events are still buffered from this thread as each
+                    # fetch completes
+                    executor = ThreadPoolExecutor(
+                        max_workers=self.detail_workers)
+                    try:
+                        fetches = _windowed_fetch(
+                            executor,
+                            partial(_safe_api_call_with_retry,
+                                    self.tenable.plugins.plugin_details),
+                            plugin_ids,
+                            2 * self.detail_workers)
+
+                        for plugin_id, future in fetches:
+                            try:
+                                plugin_details = future.result()
+                                plugin_details['family_name'] = family_name
+                                plugin_details['family_id'] = family_id
 
-                    for plugin_summary in plugins:
-                        plugin_id = plugin_summary.get('id')
-                        if self.is_processed(str(plugin_id)):
-                            continue
-
-                        try:
-                            plugin_details = _safe_api_call_with_retry(
-                                self.tenable.plugins.plugin_details, plugin_id)
-                            plugin_details['family_name'] = family_name
-                            plugin_details['family_id'] = family_id
-
-                            if self.send_event(
-                                    plugin_details, item_id=str(plugin_id)):
-                                event_count += 1
-                                self.log_progress(event_count)
-
-                            if self.should_stop(event_count):
-                                break
-                        except Exception as e:
-                            self.logger.warning(
-                                "Failed to fetch details for plugin {0}: {1}".format(
-                                    plugin_id, str(e)))
-                            continue
+                                if self.send_event(
+                                        plugin_details, item_id=str(plugin_id)):
+                                    event_count += 1
+                                    self.log_progress(event_count)
+                                    if self.should_stop(event_count):
+                                        break
+                            except Exception as e:
+                                self.logger.warning(
+                                    "Failed to fetch details for plugin {0}: {1}".format(
+                                        plugin_id, str(e)))
+                                continue
+                    finally:
+                        # Don't fetch what we won't send after max_events
+                        executor.shutdown(cancel_futures=True)
 
                     if self.should_stop(event_count):
                         break
@@ -137,9 +297,23 @@ class ComplianceFeedProcessor(BaseFeedProcessor):
             batch_size,
             max_events)
 
+        # Concurrent host_details calls per scan
+        self.host_workers = max(
+            1, int(os.getenv('COMPLIANCE_HOST_WORKERS', 8)))
+
+    def _fetch_host_details(self, scan_id, host_id):
+        # Runs on a worker thread - errors are returned, not raised, so one
+        # bad host doesn't stop the rest of the scan
+        try:
+            return _safe_api_call_with_retry(
+                self.tenable.scans.host_details, scan_id, host_id), None
+        except Exception as e:
+            return None, e
+
     def process(self):
         self.log_start()
         event_count = 0
+        executor = ThreadPoolExecutor(max_workers=self.host_workers)
 
         try:
             last_timestamp = self.get_last_timestamp()
@@ -169,13 +343,24 @@ class ComplianceFeedProcessor(BaseFeedProcessor):
                         self.tenable.scans.details, scan_id)
                     hosts = scan_details.get('hosts', [])
 
-                    for host in hosts:
-                        host_id = host.get('host_id')
+                    # Fetch host details concurrently through a bounded
+                    # window, consume them in host order on this thread as
+                    # they arrive (each result is dropped once consumed)
+                    fetches = _windowed_fetch(
+                        executor,
+                        partial(self._fetch_host_details, scan_id),
+                        [host.get('host_id') for host in hosts],
+                        2 * self.host_workers,
+                        ordered=True)
+
+                    for host, (host_id, fetch) in zip(hosts, fetches):
                         hostname = host.get('hostname', 'unknown')
 
                         try:
-                            host_details = _safe_api_call_with_retry(
-                                self.tenable.scans.host_details, scan_id, host_id)
+                            host_details, error = fetch.result()
+                            del fetch
+                            if error is not None:
+                                raise error
                             compliance_items = host_details.get(
                                 'compliance', [])
 
@@ -220,5 +405,7 @@ class ComplianceFeedProcessor(BaseFeedProcessor):
             self.logger.error(
                 "Error processing compliance feed: {0}".format(
                     str(e)))
+        finally:
+            executor.shutdown(cancel_futures=True)
 
         return event_count
@@ -2,11 +2,39 @@
 # Vulnerability feed processors with unique severity/state filters for
 # concurrent execution
 import time
+import logging
 from feeds.base import BaseFeedProcessor
 from feeds.assets import _safe_export_with_retry
 
 
+# Shared stand-in for a missing sub-dict (read only, never mutated)
+_EMPTY = {}
+
+
+def _vuln_key(vuln):
+    # Dedup key: asset, plugin, port and protocol. Stays a string - keys are
+    # persisted in the JSON checkpoint
+    asset = vuln.get('asset') or _EMPTY
+    plugin = vuln.get('plugin') or _EMPTY
+    port = vuln.get('port') or _EMPTY
+    return (f"{asset.get('uuid', 'unknown')}_{plugin.get('id', 'unknown')}_"
+            f"{port.get('port', '0')}_{port.get('protocol', 'tcp')}")
+
+
+def _has_agent(vuln):
+    return (vuln.get('asset') or _EMPTY).get('has_agent', False)
+
+
+def _is_open_on_agent(vuln):
+    return (str(vuln.get('state', '')).upper() == 'OPEN' and
+            _has_agent(vuln))
+
+
 class VulnerabilityFeedProcessor(BaseFeedProcessor):
+    # Export filters, also applied per record when the export is shared
+    # (see CompositeVulnerabilityPipeline)
+    export_severity = ('medium', 'high', 'critical')
+    export_state = None
 
     def __init__(self, tenable_client, checkpoint_mgr,
                  hec_handler, batch_size=5000, max_events=0):
@@ -23,6 +51,10 @@ class VulnerabilityFeedProcessor(BaseFeedProcessor):
             batch_size,
             max_events)
 
+    def accepts(self, vuln):
+        # Record filter used when this feed reads a shared export
+        return vuln.get('severity') in self.export_severity
+
     def process(self):
         self.log_start()
         event_count = 0
@@ -42,7 +74,7 @@ class VulnerabilityFeedProcessor(BaseFeedProcessor):
             # - timeout=3600 (1 hour max wait)
             # - since filter for incremental updates
             export_kwargs = {
-                'severity': ['medium', 'high', 'critical'],
+                'severity': list(self.export_severity),
                 'num_assets': 2000,
                 'include_unlicensed': True,
                 'timeout': 3600
@@ -59,26 +91,11 @@ class VulnerabilityFeedProcessor(BaseFeedProcessor):
             latest_timestamp = int(last_timestamp or 0)
             current_time = int(time.time())
 
-            for vuln in _safe_export_with_retry(
-                lambda: self.tenable.exports.vulns(**export_kwargs),
-                "Active Vulnerabilities"
-            ):
-                vuln_key = "{0}_{1}_{2}_{3}".format(
-                    vuln.get('asset', {}).get('uuid', 'unknown'),
-                    vuln.get('plugin', {}).get('id', 'unknown'),
-                    vuln.get('port', {}).get('port', '0'),
-                    vuln.get('port', {}).get('protocol', 'tcp')
-                )
-
-                if self.is_processed(vuln_key):
-                    continue
-
-                if self.send_event(vuln, item_id=vuln_key):
-                    event_count += 1
-                    self.log_progress(event_count)
-
-                if self.should_stop(event_count):
-                    break
+            event_count = self._run_export_loop(
+                _safe_export_with_retry(
+                    lambda: self.tenable.exports.vulns(**export_kwargs),
+                    "Active Vulnerabilities"),
+                _vuln_key)
 
             self.flush_events()
 
@@ -98,6 +115,8 @@ class VulnerabilityFeedProcessor(BaseFeedProcessor):
 
 
 class VulnerabilityNoInfoProcessor(BaseFeedProcessor):
+    export_severity = ('info',)
+    export_state = None
 
     def __init__(self, tenable_client, checkpoint_mgr,
                  hec_handler, batch_size=5000, max_events=0):
@@ -114,6 +133,9 @@ class VulnerabilityNoInfoProcessor(BaseFeedProcessor):
             batch_size,
             max_events)
 
+    def accepts(self, vuln):
+        return vuln.get('severity') in self.export_severity
+
     def process(self):
         self.log_start()
         event_count = 0
@@ -126,7 +148,7 @@ class VulnerabilityNoInfoProcessor(BaseFeedProcessor):
 
             # Optimized export parameters
             export_kwargs = {
-                'severity': ['info'],
+                'severity': list(self.export_severity),
                 'num_assets': 2000,
                 'include_unlicensed': True,
                 'timeout': 3600
@@ -139,26 +161,11 @@ class VulnerabilityNoInfoProcessor(BaseFeedProcessor):
 
             current_time = int(time.time())
 
-            for vuln in _safe_export_with_retry(
-                lambda: self.tenable.exports.vulns(**export_kwargs),
-                "Informational Vulnerabilities"
-            ):
-                vuln_key = "{0}_{1}_{2}_{3}".format(
-                    vuln.get('asset', {}).get('uuid', 'unknown'),
-                    vuln.get('plugin', {}).get('id', 'unknown'),
-                    vuln.get('port', {}).get('port', '0'),
-                    vuln.get('port', {}).get('protocol', 'tcp')
-                )
-
-                if self.is_processed(vuln_key):
-                    continue
-
-                if self.send_event(vuln, item_id=vuln_key):
-                    event_count += 1
-                    self.log_progress(event_count)
-
-                if self.should_stop(event_count):
-                    break
+            event_count = self._run_export_loop(
+                _safe_export_with_retry(
+                    lambda: self.tenable.exports.vulns(**export_kwargs),
+                    "Informational Vulnerabilities"),
+                _vuln_key)
 
             self.flush_events()
 
@@ -175,6 +182,8 @@ class VulnerabilityNoInfoProcessor(BaseFeedProcessor):
 
 
 class VulnerabilitySelfScanProcessor(BaseFeedProcessor):
+    export_severity = None
+    export_state = 'OPEN'
 
     def __init__(self, tenable_client, checkpoint_mgr,
                  hec_handler, batch_size=5000, max_events=0):
@@ -191,6 +200,9 @@ class VulnerabilitySelfScanProcessor(BaseFeedProcessor):
             batch_size,
             max_events)
 
+    def accepts(self, vuln):
+        return _is_open_on_agent(vuln)
+
     def process(self):
         self.log_start()
         event_count = 0
@@ -202,7 +214,7 @@ class VulnerabilitySelfScanProcessor(BaseFeedProcessor):
 
             # Optimized export with state='OPEN' for agent-scanned vulns
             export_kwargs = {
-                'state': 'OPEN',
+                'state': self.export_state,
                 'num_assets': 2000,
                 'include_unlicensed': True,
                 'timeout': 3600
@@ -215,30 +227,12 @@ class VulnerabilitySelfScanProcessor(BaseFeedProcessor):
 
             current_time = int(time.time())
 
-            for vuln in _safe_export_with_retry(
-                lambda: self.tenable.exports.vulns(**export_kwargs),
-                "Agent-Based Vulnerabilities"
-            ):
-                asset_info = vuln.get('asset', {})
-                if not asset_info.get('has_agent', False):
-                    continue
-
-                vuln_key = "{0}_{1}_{2}_{3}".format(
-                    asset_info.get('uuid', 'unknown'),
-                    vuln.get('plugin', {}).get('id', 'unknown'),
-                    vuln.get('port', {}).get('port', '0'),
-                    vuln.get('port', {}).get('protocol', 'tcp')
-                )
-
-                if self.is_processed(vuln_key):
-                    continue
-
-                if self.send_event(vuln, item_id=vuln_key):
-                    event_count += 1
-                    self.log_progress(event_count)
-
-                if self.should_stop(event_count):
-                    break
+            event_count = self._run_export_loop(
+                _safe_export_with_retry(
+                    lambda: self.tenable.exports.vulns(**export_kwargs),
+                    "Agent-Based Vulnerabilities"),
+                _vuln_key,
+                item_filter=_has_agent)
 
             self.flush_events()
 
@@ -280,7 +274,14 @@ class FixedVulnerabilityProcessor(BaseFeedProcessor):
                 "Found {0} vulnerabilities in previous checkpoint".format(
                     len(previous_vulns)))
 
-            current_vulns = set()
+            # Diff while streaming, as for deleted assets: whatever is left
+            # in fixed_vulns after the export was not seen (the fresh set
+            # from get_processed_ids is consumed in place). Current keys go
+            # to the checkpoint in batch_size chunks instead of a second
+            # full-size set
+            fixed_vulns = previous_vulns
+            current_vulns = []
+            current_count = 0
             self.logger.info(
                 "Fetching current vulnerabilities from Tenable...")
             self.logger.info(
@@ -298,18 +299,17 @@ class FixedVulnerabilityProcessor(BaseFeedProcessor):
                 lambda: self.tenable.exports.vulns(**export_kwargs),
                 "Fixed Vulnerabilities"
             ):
-                vuln_key = "{0}_{1}_{2}_{3}".format(
-                    vuln.get('asset', {}).get('uuid', 'unknown'),
-                    vuln.get('plugin', {}).get('id', 'unknown'),
-                    vuln.get('port', {}).get('port', '0'),
-                    vuln.get('port', {}).get('protocol', 'tcp')
-                )
-                current_vulns.add(vuln_key)
+                vuln_key = _vuln_key(vuln)
+                current_vulns.append(vuln_key)
+                fixed_vulns.discard(vuln_key)
+                current_count += 1
+
+                if len(current_vulns) >= self.batch_size:
+                    self.mark_processed_batch(current_vulns)
+                    current_vulns = []
 
             self.logger.info(
-                "Found {0} current vulnerabilities".format(
-                    len(current_vulns)))
-            fixed_vulns = previous_vulns - current_vulns
+                "Found {0} current vulnerabilities".format(current_count))
 
             if fixed_vulns:
                 self.logger.info(
@@ -329,14 +329,14 @@ class FixedVulnerabilityProcessor(BaseFeedProcessor):
                     if self.send_event(fix_event):
                         event_count += 1
                         self.log_progress(event_count)
-
-                    if self.should_stop(event_count):
-                        break
+                        if self.should_stop(event_count):
+                            break
             else:
                 self.logger.info("No fixed vulnerabilities detected")
 
-            for vuln_key in current_vulns:
-                self.mark_processed(vuln_key)
+            # Record the tail of current vulns not yet checkpointed
+            if current_vulns:
+                self.mark_processed_batch(current_vulns)
 
             self.flush_events()
             self.log_completion(event_count)
@@ -346,3 +346,98 @@ class FixedVulnerabilityProcessor(BaseFeedProcessor):
                     str(e)))
 
         return event_count
+
+
+class CompositeVulnerabilityPipeline(object):
+    # Runs several incremental vulnerability feeds off ONE export job: the
+    # export covers the union of their filters since the oldest of their
+    # checkpoints, and each record is handed to every feed that accepts it
+    # Feeds without a checkpoint timestamp yet are left out (their first
+    # run needs a full export) and run on their own as before
+
+    def __init__(self, tenable_client, processors):
+        self.tenable = tenable_client
+        self.processors = processors
+        self.logger = logging.getLogger(__name__)
+
+    def _export_kwargs(self, processors, since):
+        export_kwargs = {
+            'num_assets': 2000,
+            'include_unlicensed': True,
+            'timeout': 3600,
+            'since': int(since)
+        }
+        # Narrow the export only where every feed agrees on a filter
+        if all(p.export_severity for p in processors):
+            severities = set()
+            for p in processors:
+                severities.update(p.export_severity)
+            export_kwargs['severity'] = sorted(severities)
+        states = set(p.export_state for p in processors)
+        if len(states) == 1 and None not in states:
+            export_kwargs['state'] = states.pop()
+        return export_kwargs
+
+    def process(self):
+        # Returns {checkpoint_key: events} for the feeds handled here; an
+        # export error is raised (after flushing what was buffered)
+        processors = []
+        last_timestamps = []
+        for processor in self.processors:
+            last_timestamp = processor.get_last_timestamp()
+            if last_timestamp and last_timestamp > 0:
+                processors.append(processor)
+                last_timestamps.append(last_timestamp)
+        if len(processors) < 2:
+            return {}
+
+        since = min(last_timestamps)
+        export_kwargs = self._export_kwargs(processors, since)
+        self.logger.info(
+            "Shared vulnerability export for {0} since {1}".format(
+                ', '.join(p.feed_name for p in processors), since))
+
+        for processor in processors:
+            processor.log_start()
+        counts = [0] * len(processors)
+        active = list(range(len(processors)))
+        current_time = int(time.time())
+
+        try:
+            for vuln in _safe_export_with_retry(
+                lambda: self.tenable.exports.vulns(**export_kwargs),
+                "Shared Vulnerabilities"
+            ):
+                vuln_key = None
+                for i in active:
+                    processor = processors[i]
+                    if not processor.accepts(vuln):
+                        continue
+                    if vuln_key is None:
+                        vuln_key = _vuln_key(vuln)
+                    if processor.is_processed(vuln_key):
+                        continue
+                    # Feeds only read the record, so one dict is buffered
+                    # by each of them
+                    if processor.send_event(vuln, item_id=vuln_key):
+                        counts[i] += 1
+                        processor.log_progress(counts[i])
+                        if processor.should_stop(counts[i]):
+                            active = [j for j in active if j != i]
+                if not active:
+                    break
+
+        finally:
+            # Always land buffered/in-flight batches and stop the HEC
+            # workers; errors propagate so the caller can fall back to
+            # running the feeds one by one
+            for processor in processors:
+                processor.flush_events()
+
+        for i, processor in enumerate(processors):
+            if counts[i] > 0:
+                processor.set_last_timestamp(current_time)
+            processor.log_completion(counts[i])
+
+        return dict(
+            (p.checkpoint_key, counts[i]) for i, p in enumerate(processors))
@@ -25,14 +25,23 @@ from datetime import datetime
 try:
     import orjson
 
-    def json_dumps(obj):
-        return orjson.dumps(obj).decode('utf-8')
+    _LINE_OPTIONS = orjson.OPT_APPEND_NEWLINE
+
+    def json_dumps_line(obj):
+        # One newline-terminated batch line, newline appended by orjson.
+        # Non-string keys are retried stringified, as json.dumps does
+        try:
+            return orjson.dumps(obj, option=_LINE_OPTIONS)
+        except TypeError:
+            return orjson.dumps(
+                obj, option=_LINE_OPTIONS | orjson.OPT_NON_STR_KEYS)
     JSON_LIBRARY = 'orjson'
 except ImportError:
     import json
 
-    def json_dumps(obj):
-        return json.dumps(obj, separators=(',', ':'))  # Compact output
+    def json_dumps_line(obj):
+        # Compact output, newline-terminated
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
     JSON_LIBRARY = 'json'
 
 
@@ -94,8 +103,12 @@ class http_event_collector:
         self.ssl_ca_cert = ssl_ca_cert
         self.ssl_verify = http_event_server_ssl  # Controls both HTTPS and cert verification
         self.batchEvents = []
+        # Set to a list to record (event_count, delivered) for every POST
+        self.flushResults = None
         self.maxByteLength = max_bytes
         self.currentByteLength = 0
+        # Running total of serialized event bytes batched (never reset)
+        self.serializedBytes = 0
         self.server_uri = []
 
         # Retry configuration
@@ -216,17 +229,74 @@ class http_event_collector:
             if 'time' not in payload:
                 payload['time'] = str(int(time.time()))
 
-        # Convert payload to JSON (uses orjson if available for 10x speed)
-        payloadString = json_dumps(payload)
-        payloadLength = len(payloadString)
+        # Convert payload to a JSON line (uses orjson if available for 10x
+        # speed); batches stay bytes all the way to gzip
+        payloadBytes = json_dumps_line(payload)
+        payloadLength = len(payloadBytes)
 
         # Check if adding this event would exceed max batch size
         if (self.currentByteLength + payloadLength) > self.maxByteLength:
             self.flushBatch()
 
         # Add event to batch
-        self.batchEvents.append(payloadString)
+        self.batchEvents.append(payloadBytes)
         self.currentByteLength += payloadLength
+        self.serializedBytes += payloadLength
+
+    def sendEvents(self, payloads, skipped=None):
+        """
+        Add many events to the batch in one call
+
+        Applies the same metadata defaults as sendEvent, with host, index
+        and the default event time resolved once for the whole call.
+
+        Args:
+            payloads: Iterable of event payload dictionaries
+            skipped: Optional list that receives the positions of payloads
+                that could not be serialized (and were not batched)
+
+        Returns:
+            Number of events added to the batch
+        """
+        host = self.host
+        index = self.index
+        default_time = str(int(time.time()))
+        added = 0
+
+        for position, payload in enumerate(payloads):
+            if 'host' not in payload:
+                payload['host'] = host
+            if index and 'index' not in payload:
+                payload['index'] = index
+            if 'time' not in payload:
+                payload['time'] = default_time
+
+            try:
+                payloadBytes = json_dumps_line(payload)
+            except (TypeError, ValueError) as e:
+                self.logger.error(f"Failed to serialize HEC event: {e}")
+                if skipped is not None:
+                    skipped.append(position)
+                continue
+            payloadLength = len(payloadBytes)
+
+            # Check if adding this event would exceed max batch size
+            if (self.currentByteLength + payloadLength) > self.maxByteLength:
+                self.flushBatch()
+
+            self.batchEvents.append(payloadBytes)
+            self.currentByteLength += payloadLength
+            self.serializedBytes += payloadLength
+            added += 1
+
+        return added
+
+    def _recordFlush(self, event_count, delivered):
+        """
+        Note the outcome of one POST when flushResults is being collected
+        """
+        if self.flushResults is not None:
+            self.flushResults.append((event_count, delivered))
 
     def flushBatch(self):
         """
@@ -235,13 +305,12 @@ class http_event_collector:
         if len(self.batchEvents) == 0:
             return
 
-        # Combine all events with newlines
-        payload = '\n'.join(self.batchEvents)
+        # Events are already newline-terminated - one concatenation
+        payload = b''.join(self.batchEvents)
         event_count = len(self.batchEvents)
 
         # Compress payload for faster network transfer (typically 10x smaller)
-        compressed_payload = gzip.compress(
-            payload.encode('utf-8'), compresslevel=6)
+        compressed_payload = gzip.compress(payload, compresslevel=6)
 
         # Prepare headers with gzip encoding
         headers = {
@@ -273,6 +342,7 @@ class http_event_collector:
                 # Check response
                 if response.status_code == 200:
                     self.send_count += event_count
+                    self._recordFlush(event_count, True)
                     # Reset batch on success
                     self.batchEvents = []
                     self.currentByteLength = 0
@@ -327,6 +397,7 @@ class http_event_collector:
                 self.error_count += 1
                 self.logger.error(
                     f"HEC Event Collector error: {response.status_code} - {response.text}")
+                self._recordFlush(event_count, False)
                 # Reset batch even on error to prevent stuck data
                 self.batchEvents = []
                 self.currentByteLength = 0
@@ -368,6 +439,7 @@ class http_event_collector:
             except Exception as e:
                 self.error_count += 1
                 self.logger.error(f"HEC Event Collector exception: {e}")
+                self._recordFlush(event_count, False)
                 # Reset batch on exception
                 self.batchEvents = []
                 self.currentByteLength = 0
@@ -377,6 +449,7 @@ class http_event_collector:
         self.error_count += 1
         self.logger.error(
             f"HEC request failed after {self.max_retries + 1} attempts: {last_error}")
+        self._recordFlush(event_count, False)
         # Reset batch to prevent stuck state
         self.batchEvents = []
         self.currentByteLength = 0
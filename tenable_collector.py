@@ -5,7 +5,8 @@ from feeds.vulnerabilities import (
     VulnerabilityFeedProcessor,
     VulnerabilityNoInfoProcessor,
     VulnerabilitySelfScanProcessor,
-    FixedVulnerabilityProcessor)
+    FixedVulnerabilityProcessor,
+    CompositeVulnerabilityPipeline)
 from feeds.assets import (AssetFeedProcessor, AssetSelfScanProcessor,
                           DeletedAssetProcessor, TerminatedAssetProcessor)
 from tenable_common import CriblHECHandler, setup_logging, validate_environment, CollectorMetrics
@@ -104,7 +105,9 @@ class TenableIntegration:
             checkpoint_dir=os.getenv('CHECKPOINT_DIR', 'checkpoints'),
             key_prefix='tenable',
             max_ids=int(os.getenv('CHECKPOINT_MAX_IDS', 500000)),
-            retention_days=int(os.getenv('CHECKPOINT_RETENTION_DAYS', 7))
+            retention_days=int(os.getenv('CHECKPOINT_RETENTION_DAYS', 7)),
+            compress=os.getenv(
+                'CHECKPOINT_COMPRESS', 'false').lower() == 'true'
         )
         self.logger.info("Initialized file-based checkpointing")
 
@@ -143,6 +146,11 @@ class TenableIntegration:
         # export
         self.inter_feed_delay = float(os.getenv('INTER_FEED_DELAY', 60))
 
+        # Incremental vulnerability feeds selected together read one shared
+        # export instead of one export each (ENABLED by default)
+        self.shared_vuln_export = os.getenv(
+            'SHARED_VULN_EXPORT', 'true').lower() == 'true'
+
         if self.fully_sequential:
             self.logger.info(
                 "Execution mode: FULLY SEQUENTIAL (safest, {0}s delay between feeds)".format(
@@ -216,6 +224,40 @@ class TenableIntegration:
                     feed_name, str(e)), exc_info=True)
             return 0
 
+    def _process_shared_vuln_feeds(self, feed_names):
+        # Run the incremental vulnerability feeds among feed_names off one
+        # shared export. Returns {feed_name: events} for the feeds handled;
+        # the caller runs the rest (and any left out here) one by one
+        shared_feeds = [
+            f for f in feed_names if f in (
+                'tenableio_vulnerability',
+                'tenableio_vulnerability_no_info',
+                'tenableio_vulnerability_self_scan')]
+        if (not self.shared_vuln_export or len(shared_feeds) < 2 or
+                self._shutdown_event.is_set()):
+            return {}
+
+        try:
+            start_time = time.time()
+            results = CompositeVulnerabilityPipeline(
+                self.tenable,
+                [self._get_processor(f) for f in shared_feeds]).process()
+
+            elapsed = time.time() - start_time
+            for feed_name, event_count in results.items():
+                self.metrics.record_feed(feed_name, event_count, elapsed)
+
+            self.checkpoint.flush_all()
+            return results
+        except Exception as e:
+            # Nothing recorded as done - the caller runs each feed on its
+            # own (anything already delivered is skipped via checkpoints)
+            self.metrics.record_error('shared_vulnerability_export', str(e))
+            self.logger.error(
+                "Error processing shared vulnerability export, falling back to per-feed exports: {0}".format(
+                    str(e)), exc_info=True)
+            return {}
+
     def _process_group_sequentially(self, group_name, group_feeds):
         # Process all feeds in a group sequentially (one at a time)
         # This is used when smart grouping is enabled
@@ -226,8 +268,15 @@ class TenableIntegration:
             "[{0}] Starting group with {1} feeds (sequential, {2}s delay between)".format(
                 group_name, len(group_feeds), self.inter_feed_delay))
 
-        total_events = 0
-        feed_results = {}
+        feed_results = self._process_shared_vuln_feeds(group_feeds)
+        total_events = sum(feed_results.values())
+        group_feeds = [f for f in group_feeds if f not in feed_results]
+        if (feed_results and group_feeds and self.inter_feed_delay > 0 and
+                not self._shutdown_event.is_set()):
+            self.logger.info(
+                "[{0}] Waiting {1}s for Tenable export lock to release...".format(
+                    group_name, self.inter_feed_delay))
+            time.sleep(self.inter_feed_delay)
 
         for idx, feed_name in enumerate(group_feeds):
             if self._shutdown_event.is_set():
@@ -326,13 +375,25 @@ class TenableIntegration:
                     "FULLY SEQUENTIAL MODE: {0} feeds, {1}s delay between feeds".format(
                         len(feeds_to_process), self.inter_feed_delay))
 
-                for idx, feed_name in enumerate(feeds_to_process):
+                feed_results = self._process_shared_vuln_feeds(
+                    feeds_to_process)
+                total_events += sum(feed_results.values())
+                remaining_feeds = [
+                    f for f in feeds_to_process if f not in feed_results]
+                if (feed_results and remaining_feeds and
+                        self.inter_feed_delay > 0):
+                    self.logger.info(
+                        "  Waiting {0}s before next feed...".format(
+                            self.inter_feed_delay))
+                    time.sleep(self.inter_feed_delay)
+
+                for idx, feed_name in enumerate(remaining_feeds):
                     if self._shutdown_event.is_set():
                         self.logger.warning("Shutdown requested, stopping")
                         break
 
                     self.logger.info("Processing feed {0}/{1}: {2}".format(
-                        idx + 1, len(feeds_to_process), feed_name))
+                        idx + 1, len(remaining_feeds), feed_name))
                     event_count = self._process_feed(feed_name)
                     total_events += event_count
                     feed_results[feed_name] = event_count
@@ -341,7 +402,7 @@ class TenableIntegration:
                             feed_name, event_count))
 
                     # Delay between feeds (except after last feed)
-                    if idx < len(feeds_to_process) - \
+                    if idx < len(remaining_feeds) - \
                             1 and self.inter_feed_delay > 0:
                         self.logger.info(
                             "  Waiting {0}s before next feed...".format(
@@ -387,10 +448,16 @@ class TenableIntegration:
                     "SEQUENTIAL MODE: {0} feeds running one at a time".format(
                         len(feeds_to_process)))
 
+                feed_results = self._process_shared_vuln_feeds(
+                    feeds_to_process)
+                total_events += sum(feed_results.values())
+
                 for feed_name in feeds_to_process:
                     if self._shutdown_event.is_set():
                         self.logger.warning("Shutdown requested, stopping")
                         break
+                    if feed_name in feed_results:
+                        continue
 
                     event_count = self._process_feed(feed_name)
                     total_events += event_count
@@ -184,49 +184,88 @@ class CriblHECHandler:
             events,
             sourcetype=None,
             feed_type=None,
-            feed_name=None):
+            feed_name=None,
+            sizes=None):
         # Send multiple events in batch mode for better performance
         # (thread-safe)
+        # Returns (delivered_count, delivered_mask): bit i of the mask is set
+        # when events[i] was accepted by HEC. A batch can span several
+        # POSTs, and any of them may fail independently
+        # sizes, if a list, receives the batch's serialized byte total
         if not events:
-            return 0
+            return 0, 0
 
         with self._lock:
-            success_count = 0
             batch_sourcetype = sourcetype or self.sourcetype
-
-            # Add each event to the batch buffer
+            hec_handler = self.hec_handler
+
+            # Feed classification as HEC fields for easy filtering - one
+            # dict shared by the whole batch (payloads are only serialized)
+            fields = None
+            if feed_type:
+                fields = {
+                    'feed_type': feed_type,
+                    'feed_name': feed_name or ''
+                }
+
+            # Build every HEC payload, then hand the batch over in one call
+            payloads = []
             for event in events:
-                try:
-                    # Build HEC payload
-                    payload = {}
-                    payload['event'] = event
-                    payload['sourcetype'] = batch_sourcetype
-                    payload['source'] = self.source
-                    payload['index'] = self.index
-
-                    # Add feed classification as HEC fields for easy filtering
-                    if feed_type:
-                        payload['fields'] = {
-                            'feed_type': feed_type,
-                            'feed_name': feed_name or ''
-                        }
-
-                    self.hec_handler.sendEvent(payload)
-                    success_count += 1
-                except Exception as e:
-                    logging.error(
-                        "Failed to add event to batch: {0}".format(e))
-
-            # Flush the batch to send all buffered events
+                payload = {}
+                payload['event'] = event
+                payload['sourcetype'] = batch_sourcetype
+                payload['source'] = self.source
+                payload['index'] = self.index
+                if fields is not None:
+                    payload['fields'] = fields
+                payloads.append(payload)
+
+            # Anything left over from send_event goes out first so every
+            # recorded POST below holds only this batch's events
             try:
-                self.hec_handler.flushBatch()
-                logging.info(
-                    "HEC batch sent: {0} events | feed_type={1} | feed_name={2}".format(
-                        success_count, feed_type or 'n/a', feed_name or 'n/a'))
+                hec_handler.flushBatch()
             except Exception as e:
-                logging.error("Error flushing batch: {0}".format(e))
+                logging.error("Error flushing HEC batch: {0}".format(e))
 
-            return success_count
+            skipped = []
+            hec_handler.flushResults = []
+            start_bytes = hec_handler.serializedBytes
+            try:
+                hec_handler.sendEvents(payloads, skipped)
+                # Flush the batch to send all buffered events
+                hec_handler.flushBatch()
+            except Exception as e:
+                logging.error("Error flushing batch: {0}".format(e))
+            finally:
+                results = hec_handler.flushResults
+                hec_handler.flushResults = None
+            if sizes is not None:
+                sizes.append(hec_handler.serializedBytes - start_bytes)
+
+            # Map each POST's outcome back onto event positions (POSTs carry
+            # consecutive runs of the events that were serialized)
+            if skipped:
+                skipped = set(skipped)
+                positions = [i for i in range(len(payloads))
+                             if i not in skipped]
+            success_count = 0
+            delivered = 0
+            offset = 0
+            for event_count, ok in results:
+                if ok:
+                    success_count += event_count
+                    if skipped:
+                        for i in positions[offset:offset + event_count]:
+                            delivered |= 1 << i
+                    else:
+                        delivered |= ((1 << event_count) - 1) << offset
+                offset += event_count
+
+            logging.info(
+                "HEC batch sent: {0} events | feed_type={1} | feed_name={2}".format(
+                    success_count, feed_type or 'n/a', feed_name or 'n/a'))
+
+            return success_count, delivered
 
     def flush(self):
         """Flush any pending events in the HEC buffer (thread-safe)."""
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Tests for the file-based checkpoint manager
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import checkpoint_manager  # noqa: E402
+from checkpoint_manager import FileCheckpoint  # noqa: E402
+
+
+@unittest.skipUnless(checkpoint_manager.ZSTD_AVAILABLE,
+                     "zstandard is not installed")
+class CompressedFlushTest(unittest.TestCase):
+    # flush_all writes keys from a thread pool - compressed snapshots must
+    # survive concurrent writers
+
+    KEYS = ['key_{0}'.format(i) for i in range(8)]
+    IDS_PER_KEY = 20000
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def _ids(self, key):
+        return ['{0}-{1}'.format(key, i) for i in range(self.IDS_PER_KEY)]
+
+    def test_flush_all_over_compressed_keys(self):
+        checkpoint = FileCheckpoint(
+            checkpoint_dir=self.checkpoint_dir, max_ids=self.IDS_PER_KEY,
+            compress=True)
+        for _ in range(3):
+            for key in self.KEYS:
+                checkpoint.add_processed_ids_batch(key, self._ids(key))
+            # Extra writers alongside the flush pool
+            threads = [
+                threading.Thread(target=checkpoint.flush_all)
+                for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        reloaded = FileCheckpoint(
+            checkpoint_dir=self.checkpoint_dir, max_ids=self.IDS_PER_KEY,
+            compress=True)
+        for key in self.KEYS:
+            with open(reloaded._get_checkpoint_file(key), 'rb') as f:
+                self.assertEqual(f.read(4), checkpoint_manager._ZSTD_MAGIC)
+            self.assertEqual(
+                reloaded.get_processed_ids(key), set(self._ids(key)))
+
+
+if __name__ == '__main__':
+    unittest.main()